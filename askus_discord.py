@@ -1,12 +1,18 @@
+import asyncio
 import discord
 from discord.ext import tasks
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
-import json
-from typing import Dict
-from pollclient import PollClient
-import random
+from typing import Dict, List, Optional, Set, Tuple
+from collections import defaultdict
+from commands import AskUsCommands
+from metrics import timed
+from pollclient import PollClient, cache_kwargs, metrics_kwargs, sharding_kwargs
+from questionbank import next_ordinal, question_doc, question_hash, shuffled_index
+from storage import DuplicateKeyError
+from tally import PollTally
 import os
+import random
 
 load_dotenv()
 TOKEN =  os.getenv("DISCORD_TOKEN")
@@ -15,28 +21,50 @@ TZ = timezone.utc
 
 class AskUsClient(PollClient):
 
-    COMMAND_PREFIX = "/askus"
+    COLLECTIONS = PollClient.COLLECTIONS + ["askus", "questions", "session_stats", "member_stats"]
 
     def __init__(
         self,
         *args,
+        askus_concurrency: int = 8,
         **kwargs,
     ):
         """Poll client for discord
 
         Args:
             db_url (_type_, optional): url of the mongo database. Defaults to "mongodb://localhost:27017/".
+            askus_concurrency (int, optional): maximum number of askus polls posted at the same time. Defaults to 8.
         """
         super().__init__(*args, **kwargs)
         self.askus_collection = None
         self.question_collection = None
+        self.session_stats_collection = None
+        self.member_stats_collection = None
+        self.askus_concurrency = askus_concurrency
+        self.askus_stats: Dict[str, float] = {}  # posting skew of the last check_askus tick
+        self.session_channels: Set[int] = set()  # channels of the running sessions
+        self.tree.add_command(AskUsCommands(self))
 
     def setup_database(self):
         super().setup_database()
-        self.askus_collection = self.database.get_collection("askus")
-        self.question_collection = self.database.get_collection("questions")
+        self.askus_collection = self.open_collection("askus")
+        self.question_collection = self.open_collection("questions")
+        self.session_stats_collection = self.open_collection("session_stats")
+        self.member_stats_collection = self.open_collection("member_stats")
+
+    async def warm_up(self) -> None:
+        await asyncio.gather(super().warm_up(), self.load_sessions())
+
+    async def load_sessions(self) -> None:
+        """Loads the channels of the running sessions, whose name maps are warmed at startup"""
+        async for sessions in self.askus_collection.find_batches({"paused": False}, {"_id": 1}):
+            self.session_channels.update(session["_id"] for session in sessions)
+
+    def warm_channel_ids(self) -> Set[int]:
+        return super().warm_channel_ids() | self.session_channels
 
     async def setup_hook(self) -> None:
+        await super().setup_hook()
         self.my_background_task.start()
 
     async def on_ready(self):
@@ -45,134 +73,220 @@ class AskUsClient(PollClient):
 
     @tasks.loop(seconds=30)
     async def my_background_task(self):
-        await self.close_polls()
-        await self.check_askus()
+        try:
+            await self.check_askus()
+        except Exception as e:
+            # tasks.loop stops on most errors, the due sessions are checked again at the next tick
+            print(f"Failed to check askus sessions : {e}")
 
     @my_background_task.before_loop
     async def before_my_task(self):
         await self.wait_until_ready()
 
-    async def on_message(self, message: discord.Message):
-        if message.author.id == self.user.id or message.author.bot:
-            return
-        if not message.content.startswith(self.COMMAND_PREFIX):
-            return
+    async def ensure_indexes(self):
+        """Creates the indexes of the collections, and numbers and hashes the questions created before ordinals and
+        hashes existed"""
+        await super().ensure_indexes()
+        unnumbered = await self.question_collection.find({"ordinal": {"$exists": False}}, {"_id": 1})
+        if unnumbered:
+            first = await next_ordinal(self.question_collection)
+            await self.question_collection.bulk_update(
+                [({"_id": doc["_id"]}, {"$set": {"ordinal": first + offset}}) for offset, doc in enumerate(unnumbered)]
+            )
+        unhashed = await self.question_collection.find({"text_hash": {"$exists": False}}, {"question": 1})
+        if unhashed:
+            hashes = set()
+            async for docs in self.question_collection.find_batches({"text_hash": {"$exists": True}}, {"text_hash": 1}):
+                hashes.update(doc["text_hash"] for doc in docs)
+            updates = []
+            for doc in unhashed:
+                # duplicates already in the bank keep no hash, the unique index would refuse them
+                text_hash = question_hash(doc["question"])
+                if text_hash not in hashes:
+                    hashes.add(text_hash)
+                    updates.append(({"_id": doc["_id"]}, {"$set": {"text_hash": text_hash}}))
+            await self.question_collection.bulk_update(updates)
 
-        new_content = message.content.removeprefix(self.COMMAND_PREFIX).strip()
-        if new_content.startswith("help"):
-            await message.channel.send("Sent you help in DM !")
-            if message.author.dm_channel is None:
-                await message.author.create_dm()
-            await message.author.dm_channel.send(self.get_help())
-            return
-        if new_content.startswith("question"):
-            new_content = new_content.removeprefix("question").strip()
-            parts = new_content.split("|")
-            question = parts[0]
-            answers = []
-            if len(parts) > 1:
-                answers = parts[1].split(",")
-            self.add_question(question, answers=answers)
-            await message.channel.send("J'ai bien ajouté ta question !")
-            return
+    async def pick_question(self, session: dict, bank_size: int = None) -> Tuple[Optional[dict], int, dict]:
+        """Picks the next question of a session. Each session asks the questions in its own shuffled order: a pass
+        goes through the ordinals [pass_start, pass_end) in the order of a permutation picked by the seed of the
+        session, then the next pass goes through the questions added meanwhile. A session only remembers its seed,
+        its pass and its position in the pass
 
-        if message.channel.type != discord.ChannelType.text:
-            return
-        if new_content.startswith("start"):
-            new_content = new_content.removeprefix("start").strip()
-            try:
-                args, kwargs = json.loads(new_content).values()
-                self.start_askus(message.channel.id, *args, **kwargs)
-            except Exception as e:
-                await message.channel.send(f"There was an error in your inputs : \n {e}\n Try /poll help !")
-                raise Exception(e.with_traceback())
-            return
-
-        if new_content.startswith("stop"):
-            self.stop_askus(message.channel.id)
-            return
+        Args:
+            session (dict): askus session
+            bank_size (int, optional): ordinal of the next question added to the bank, read from the database when
+                not given. Defaults to None.
 
-        if new_content.startswith("pause"):
-            self.pause_askus(message.channel.id)
-            return
+        Returns:
+            Tuple[Optional[dict], int, dict]: the question, None if every question was asked, the number of questions
+            left including it, and the progress of the session to store once it is posted
+        """
+        if bank_size is None:
+            bank_size = await next_ordinal(self.question_collection)
+        seed = session["seed"] if "seed" in session else random.getrandbits(32)
+        start, end, position = session.get("pass_start", 0), session.get("pass_end", 0), session.get("position", 0)
+        # sessions started before the shuffled order still skip the questions they asked
+        asked = set(session.get("asked_questions") or [])
+        while True:
+            if position >= end - start:
+                if end >= bank_size:
+                    return None, 0, {}
+                start, end, position = end, bank_size, 0
+            ordinal = start + shuffled_index(f"{seed}:{start}", position, end - start)
+            position += 1
+            question = await self.question_collection.find_one({"ordinal": ordinal})
+            if question is not None and question["_id"] not in asked:
+                break
+        remaining = end - start - position + 1 + bank_size - end
+        return question, remaining, {"seed": seed, "pass_start": start, "pass_end": end, "position": position}
 
-        if new_content.startswith("nickname"):
-            new_content = new_content.removeprefix("nickname").strip()
-            member_id, nickname = new_content.split(" ", 1)
-            try:
-                member_id = int(member_id)
-            except:
-                await message.channel.send("Member id is not an integer")
-                return
-            page = self.nickname_collection.find_one({"_id": message.channel.id})
-            if not page:
-                page = {"_id": message.channel.id, "nicknames": {}}
-                self.nickname_collection.insert_one(page)
-            new_nicknames = page["nicknames"]
-            new_nicknames[str(member_id)] = nickname
-            self.nickname_collection.find_one_and_update({"_id": message.channel.id}, {"$set": {"nicknames": new_nicknames}})
-            await message.channel.send("J'ai bien ajouté le nickname")
-
-        
+    @timed("check_askus")
     async def check_askus(self):
-        """Checks to see if new polls needs to be posted and poss them
+        """Checks to see if new polls needs to be posted and poss them. Due sessions are posted concurrently, at most
+        askus_concurrency at a time and one at a time per guild, guilds taking turns for the free slots
         """
-        sessions = self.askus_collection.find({"next_poll_time": {"$lt": datetime.now(tz=TZ)}})
+        now = datetime.now(tz=TZ)
+        sessions = await self.askus_collection.find({"paused": False, "next_poll_time": {"$lt": now}})
         if not sessions:
             return
+        bank_size = await next_ordinal(self.question_collection)
+        by_guild: Dict[int, List[Tuple[dict, discord.abc.GuildChannel]]] = defaultdict(list)
         for session in sessions:
-            if session["paused"]:
-                continue
             channel: discord.guild.GuildChannel = self.get_channel(session["_id"])
-            if not channel:
-                continue
-
-            questions = self.question_collection.find()
-            remaining_questions = [
-                page for page in questions if page["_id"] not in session["asked_questions"]
-            ]
-            if not remaining_questions:
-                self.pause_askus(channel.id)
-                await channel.send("Je n'ai plus de question à poser, j'ai pausé la session, n'hésitez pas à en rajouter en tapant /askus question 'question' en DM !")
-                continue
-
-            question = random.choice(remaining_questions)
-            duration = timedelta(
-                **session["poll_duration"]
-            )  # py mongo supports datetime so we have to store timedelta as dict or params
-            closing_time = (datetime.now(tz=TZ) + duration).strftime("%H:%M - %d/%m/%Y")
-            thread_name = "Résultats - " + datetime.now(tz=TZ).strftime("%d/%m/%Y")
-            message = f"<@&1342105732463460392>, il est venu le temps des questions génantes ! Il me reste {len(remaining_questions) - 1} question(s) en stock. Le sondage ferme à {closing_time}"
-            
-            if "answers" in question and question["answers"]:
-                answers = question["answers"]
-            else:
-                answers = self.get_name_map(channel)
-            message_id = await self.send_poll(
-                channel,
-                question["question"],
-                answers,
-                message=message,
-                thread_name=thread_name,
-                duration=duration,
-                mode=self.CUSTOM
-            )
-            if not message_id:
-                continue
-            session["asked_questions"].append(question["_id"])
-            next_poll_time = datetime.now(tz=TZ).replace(**session["poll_time"]) + timedelta(**session["poll_period"])
-            self.askus_collection.find_one_and_update(
-                {"_id": session["_id"]},
-                {
-                    "$set": {
-                        "next_poll_time": next_poll_time,
-                        "asked_questions": session["asked_questions"],
-                    }
-                },
-            )
-        return
+            if channel:
+                by_guild[channel.guild.id].append((session, channel))
+
+        slots = asyncio.Semaphore(self.askus_concurrency)
+        skews: List[float] = []
+
+        async def post_guild(guild_sessions: List[Tuple[dict, discord.abc.GuildChannel]]):
+            for session, channel in guild_sessions:
+                # the semaphore serves waiters in order, a guild asking again goes behind the guilds already waiting
+                async with slots:
+                    # the lease is kept after posting, so a worker that read the session before it was updated
+                    # cannot post the same occurrence again
+                    lease = f"askus:{session['_id']}:{session['next_poll_time'].isoformat()}"
+                    if not await self.leases.acquire(lease, timedelta(hours=1)):
+                        continue
+                    await self.rest_limiter.acquire()
+                    try:
+                        await self.post_askus(session, channel, bank_size)
+                    except Exception as e:
+                        await self.leases.release(lease)
+                        print(f"Failed to post askus in {channel.name} : {e}")
+                    skews.append((datetime.now(tz=TZ) - session["next_poll_time"]).total_seconds())
 
-    def start_askus(
+        await asyncio.gather(*(post_guild(guild_sessions) for guild_sessions in by_guild.values()))
+        self.askus_stats = {
+            "sessions": len(skews),
+            "guilds": len(by_guild),
+            "max_skew": max(skews, default=0.0),
+            "mean_skew": sum(skews) / len(skews) if skews else 0.0,
+            "tick_duration": (datetime.now(tz=TZ) - now).total_seconds(),
+        }
+
+    def metric_gauges(self) -> Dict[str, float]:
+        gauges = super().metric_gauges()
+        gauges.update({f"askus_{key}": value for key, value in self.askus_stats.items()})
+        return gauges
+
+    async def post_askus(self, session: dict, channel: discord.abc.GuildChannel, bank_size: int = None):
+        """Posts the next question of a session and schedules the following one"""
+        question, remaining, progress = await self.pick_question(session, bank_size)
+        if question is None:
+            await self.pause_askus(channel.id)
+            await channel.send("Je n'ai plus de question à poser, j'ai pausé la session, n'hésitez pas à en rajouter en tapant /askus question 'question' en DM !")
+            return
+
+        duration = timedelta(
+            **session["poll_duration"]
+        )  # py mongo supports datetime so we have to store timedelta as dict or params
+        closing_time = (datetime.now(tz=TZ) + duration).strftime("%H:%M - %d/%m/%Y")
+        thread_name = "Résultats - " + datetime.now(tz=TZ).strftime("%d/%m/%Y")
+        message = f"<@&1342105732463460392>, il est venu le temps des questions génantes ! Il me reste {remaining - 1} question(s) en stock. Le sondage ferme à {closing_time}"
+
+        member_answers = not question.get("answers")
+        if member_answers:
+            answers = await self.get_name_map(channel)
+        else:
+            answers = dict(enumerate(question["answers"]))
+        message_id = await self.send_poll(
+            channel,
+            question["question"],
+            answers,
+            message=message,
+            thread_name=thread_name,
+            duration=duration,
+            mode=self.CUSTOM,
+            extra={"session_id": session["_id"], "member_answers": member_answers},
+        )
+        if not message_id:
+            return
+        next_poll_time = datetime.now(tz=TZ).replace(**session["poll_time"]) + timedelta(**session["poll_period"])
+        update = {"$set": {"next_poll_time": next_poll_time, **progress}}
+        if progress["pass_start"] > 0:
+            # the questions asked before the shuffled order were all in the first pass
+            update["$unset"] = {"asked_questions": ""}
+        await self.askus_collection.update_one({"_id": session["_id"]}, update)
+
+    async def archive_poll(self, doc: dict, tally: PollTally) -> bool:
+        """Archives a closed poll and, for askus polls, adds its votes to the aggregates of its session and of the
+        members of the session, so stats never read the archive
+        """
+        archived = await super().archive_poll(doc, tally)
+        if not archived or doc.get("session_id") is None:
+            return archived
+        session_id = doc["session_id"]
+        await self.session_stats_collection.update_one(
+            {"_id": session_id},
+            {"$inc": {"polls": 1, "votes": len(tally)}, "$set": {"last_closed_at": datetime.now(tz=TZ)}},
+            upsert=True,
+        )
+        increments: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for voter in tally.choices:
+            increments[str(voter)]["polls_voted"] += 1
+        if doc.get("member_answers"):
+            # the answers are the members of the channel, the votes they got are counted too
+            most_votes = max(map(len, tally.voters.values()), default=0)
+            for key, voters in tally.voters.items():
+                if voters:
+                    increments[key]["votes_received"] += len(voters)
+                    increments[key]["polls_won"] += int(len(voters) == most_votes)
+        await self.member_stats_collection.bulk_update(
+            [
+                (
+                    {"_id": f"{session_id}:{member_id}"},
+                    {"$inc": dict(counts), "$set": {"session_id": session_id, "member_id": int(member_id)}},
+                )
+                for member_id, counts in increments.items()
+            ],
+            upsert=True,
+        )
+        return True
+
+    async def get_session_stats(self, session_id: int, top: int = 5) -> Optional[dict]:
+        """Aggregated stats of a session: its totals, and the members who voted the most and got the most votes
+
+        Returns:
+            Optional[dict]: the totals with "most_active" and "most_voted" lists of member stats, None when no poll
+            of the session was closed yet
+        """
+        totals, most_active, most_voted = await asyncio.gather(
+            self.session_stats_collection.find_one({"_id": session_id}),
+            self.member_stats_collection.find({"session_id": session_id}, sort=[("polls_voted", -1)], limit=top),
+            self.member_stats_collection.find(
+                {"session_id": session_id, "votes_received": {"$gt": 0}}, sort=[("votes_received", -1)], limit=top
+            ),
+        )
+        if totals is None:
+            return None
+        return {**totals, "most_active": most_active, "most_voted": most_voted}
+
+    async def get_member_stats(self, session_id: int, member_id: int) -> Optional[dict]:
+        return await self.member_stats_collection.find_one({"_id": f"{session_id}:{member_id}"})
+
+    async def start_askus(
         self,
         channel_id: int,
         poll_time: Dict[str, int] = {"hour": 12, "minute": 0, "second": 0},
@@ -188,44 +302,70 @@ class AskUsClient(PollClient):
             poll_duration (Dict[str, int], optional): duration of the poll. Defaults to {"hours": 14, "minutes": 0, "seconds": 0}.
             poll_period (Dict[str, int], optional): period at which to send polls on the session. Defaults to {"days": 1}.
         """
-        possible_session = self.askus_collection.find_one_and_update(
+        self.session_channels.add(channel_id)
+        possible_session = await self.askus_collection.find_one_and_update(
             {"_id": channel_id}, {"$set": {"paused": False, "poll_time": poll_time, "poll_duration": poll_duration}}
         )
         # If there was a session, we unpaused it and updated poll time and duration
         if possible_session:
             return
         # If not we create it
-        self.askus_collection.insert_one(
+        await self.askus_collection.insert_one(
             {
                 "_id": channel_id,
                 "poll_time": poll_time,
                 "poll_period": poll_period,
                 "poll_duration": poll_duration,
                 "paused": False,
-                "asked_questions": [],
+                "seed": random.getrandbits(32),
+                "pass_start": 0,
+                "pass_end": 0,
+                "position": 0,
                 "next_poll_time": datetime.now(tz=TZ),
             }
         )
 
-    def stop_askus(self, channel_id: int):
+    async def stop_askus(self, channel_id: int):
         """Stops askus session
         """
-        self.askus_collection.find_one_and_delete({"_id": channel_id})
+        self.session_channels.discard(channel_id)
+        await self.askus_collection.find_one_and_delete({"_id": channel_id})
 
-    def pause_askus(self, channel_id: int):
+    async def pause_askus(self, channel_id: int):
         """Pauses askus session
         """
-        self.askus_collection.find_one_and_update({"_id": channel_id}, {"$set": {"paused": True}})
+        self.session_channels.discard(channel_id)
+        await self.askus_collection.find_one_and_update({"_id": channel_id}, {"$set": {"paused": True}})
+
+    async def add_question(self, question: str, answers: list = [], attempts: int = 3):
+        """Adds a question to the bank. It is numbered after every existing one, so running sessions ask it in their
+        next pass
+
+        Raises:
+            DuplicateKeyError: when the question is already in the bank
+        """
+        doc = question_doc(question, answers, 0)
+        for attempt in range(attempts):
+            doc["ordinal"] = await next_ordinal(self.question_collection)
+            try:
+                return await self.question_collection.insert_one(doc)
+            except DuplicateKeyError:
+                # a question added at the same time may have taken the ordinal
+                if attempt == attempts - 1 or await self.question_collection.find_one({"text_hash": doc["text_hash"]}, {"_id": 1}):
+                    raise
+
 
-    def add_question(self, question: str, answers: list = []):
-        return self.question_collection.insert_one({"question": question, "answers": answers})
+class ShardedAskUsClient(AskUsClient, discord.AutoShardedClient):
+    """AskUsClient running several shards in one process, see ShardedPollClient"""
 
 
 def main():
     intents = discord.Intents.default()
     intents.members = True
-    intents.message_content = True
-    client = AskUsClient(intents=intents)
+    kwargs = sharding_kwargs()
+    kwargs.update(metrics_kwargs())
+    kwargs.update(cache_kwargs())
+    client = ShardedAskUsClient(intents=intents, **kwargs) if "shard_count" in kwargs else AskUsClient(intents=intents, **kwargs)
     client.run(TOKEN)
 
 
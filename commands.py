@@ -0,0 +1,293 @@
+import asyncio
+import os
+import tempfile
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import aiohttp
+import discord
+from discord import app_commands
+
+from questionbank import export_questions, format_of, import_questions, parse_questions
+from storage import DuplicateKeyError
+
+MODES = [
+    app_commands.Choice(name="auto", value=0),
+    app_commands.Choice(name="custom", value=1),
+    app_commands.Choice(name="discord", value=2),
+]
+
+
+def split_list(text: Optional[str]) -> List[str]:
+    """Items of a comma separated option"""
+    return [item.strip() for item in text.split(",") if item.strip()] if text else []
+
+
+def parse_snowflake(text: str) -> int:
+    """Id given as a string option, discord integer options are too small for ids"""
+    try:
+        return int(text)
+    except ValueError:
+        raise app_commands.AppCommandError(f"{text} n'est pas un identifiant valide")
+
+
+class ClientGroup(app_commands.Group):
+    """Command group bound to a client, errors are answered to the user instead of failing silently"""
+
+    def __init__(self, client: discord.Client, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError) -> None:
+        error = getattr(error, "original", error)
+        message = f"Il y a eu une erreur : {error}\nEssaie /poll help !"
+        if interaction.response.is_done():
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
+        if not isinstance(error, app_commands.AppCommandError):
+            raise error
+
+
+class PollCommands(ClientGroup):
+    """/poll commands"""
+
+    def __init__(self, client: discord.Client):
+        super().__init__(client, name="poll", description="Sondages")
+
+    @app_commands.command(description="Envoie l'aide")
+    async def help(self, interaction: discord.Interaction):
+        await interaction.response.send_message(self.client.get_help(), ephemeral=True)
+
+    @app_commands.command(description="Crée un sondage dans ce salon")
+    @app_commands.describe(
+        question="question du sondage",
+        answers="réponses, séparées par des virgules",
+        mode="sondage discord (10 réponses max) ou maison, auto par défaut",
+        duration_hours="durée du sondage en heures",
+        message="message accompagnant le sondage",
+        thread_name="nom du fil des résultats",
+        emojis="emojis des réponses d'un sondage maison, séparés par des virgules",
+        multiple="plusieurs réponses par personne (sondages discord)",
+    )
+    @app_commands.choices(mode=MODES)
+    @app_commands.guild_only()
+    async def create(
+        self,
+        interaction: discord.Interaction,
+        question: str,
+        answers: str,
+        mode: Optional[app_commands.Choice[int]] = None,
+        duration_hours: app_commands.Range[int, 1, 768] = 24,
+        message: str = "",
+        thread_name: str = "",
+        emojis: Optional[str] = None,
+        multiple: bool = False,
+    ):
+        answer_list = split_list(answers)
+        emoji_list = split_list(emojis)
+        if emoji_list and len(emoji_list) != len(answer_list):
+            raise app_commands.AppCommandError("Il faut autant d'emojis que de réponses")
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        poll_id = await self.client.send_poll(
+            interaction.channel,
+            question,
+            dict(enumerate(answer_list)),
+            mode=mode.value if mode else self.client.AUTO,
+            message=message,
+            thread_name=thread_name,
+            duration=timedelta(hours=duration_hours),
+            emojis=dict(enumerate(emoji_list)) if emoji_list else None,
+            multiple=multiple,
+        )
+        await interaction.followup.send(f"Sondage créé ({poll_id})", ephemeral=True)
+
+    @app_commands.command(description="Supprime un sondage de ce salon")
+    @app_commands.describe(poll_id="identifiant du message du sondage")
+    @app_commands.guild_only()
+    async def remove(self, interaction: discord.Interaction, poll_id: str):
+        await interaction.response.defer(ephemeral=True)
+        removed = await self.client.remove_poll(parse_snowflake(poll_id), interaction.channel_id)
+        await interaction.followup.send("Sondage supprimé" if removed else "Sondage introuvable", ephemeral=True)
+
+    @app_commands.command(description="Supprime tous les sondages de ce salon")
+    @app_commands.guild_only()
+    async def clear(self, interaction: discord.Interaction):
+        await interaction.response.send_message("Suppression des sondages...", ephemeral=True)
+        await self.client.clear_polls(interaction.channel)
+
+    @app_commands.command(description="Clôt un sondage de ce salon")
+    @app_commands.describe(poll_id="identifiant du message du sondage")
+    @app_commands.guild_only()
+    async def close(self, interaction: discord.Interaction, poll_id: str):
+        doc = self.client.active_polls.get(parse_snowflake(poll_id))
+        if doc is None or doc["channel_id"] != interaction.channel_id:
+            await interaction.response.send_message("Sondage introuvable", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True)
+        await self.client.close_poll(doc["_id"])
+        await interaction.followup.send("Sondage clos", ephemeral=True)
+
+    @app_commands.command(description="Résultats d'un sondage, en cours ou clos")
+    @app_commands.describe(poll_id="identifiant du message du sondage")
+    async def results(self, interaction: discord.Interaction, poll_id: str):
+        counts = await self.client.get_poll_results(parse_snowflake(poll_id))
+        if counts is None:
+            await interaction.response.send_message("Sondage introuvable", ephemeral=True)
+            return
+        lines = [f"{key} : {count}" for key, count in counts.items()]
+        await interaction.response.send_message("\n".join(lines) or "Aucune réponse", ephemeral=True)
+
+    @app_commands.command(description="Donne un surnom à un membre dans les résultats de ce salon")
+    @app_commands.guild_only()
+    async def nickname(self, interaction: discord.Interaction, member: discord.Member, nickname: str):
+        await self.client.add_nickname(interaction.channel_id, str(member.id), nickname)
+        await interaction.response.send_message("J'ai bien ajouté le nickname", ephemeral=True)
+
+
+def parse_time(text: str) -> Dict[str, int]:
+    """Time of day like "12:30" or "12:30:15", in the poll_time format of AskUsClient.start_askus"""
+    try:
+        parts = [int(part) for part in text.split(":")]
+        if not 1 <= len(parts) <= 3:
+            raise ValueError
+        hour, minute, second = parts + [0] * (3 - len(parts))
+        if not (0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60):
+            raise ValueError
+    except ValueError:
+        raise app_commands.AppCommandError(f"{text} n'est pas une heure valide (HH:MM)")
+    return {"hour": hour, "minute": minute, "second": second}
+
+
+class AskUsCommands(ClientGroup):
+    """/askus commands"""
+
+    def __init__(self, client: discord.Client):
+        super().__init__(client, name="askus", description="Sessions de questions")
+
+    @app_commands.command(description="Démarre ou reprend la session de questions de ce salon")
+    @app_commands.describe(
+        time="heure d'envoi des questions (HH:MM, UTC)",
+        duration_hours="durée de chaque sondage en heures",
+        period_days="jours entre deux questions",
+    )
+    @app_commands.guild_only()
+    async def start(
+        self,
+        interaction: discord.Interaction,
+        time: str = "12:00",
+        duration_hours: app_commands.Range[int, 1, 768] = 20,
+        period_days: app_commands.Range[int, 1, 365] = 1,
+    ):
+        await self.client.start_askus(
+            interaction.channel_id, poll_time=parse_time(time), poll_duration={"hours": duration_hours}, poll_period={"days": period_days}
+        )
+        await interaction.response.send_message("Session démarrée", ephemeral=True)
+
+    @app_commands.command(description="Arrête la session de questions de ce salon")
+    @app_commands.guild_only()
+    async def stop(self, interaction: discord.Interaction):
+        await self.client.stop_askus(interaction.channel_id)
+        await interaction.response.send_message("Session arrêtée", ephemeral=True)
+
+    @app_commands.command(description="Met en pause la session de questions de ce salon")
+    @app_commands.guild_only()
+    async def pause(self, interaction: discord.Interaction):
+        await self.client.pause_askus(interaction.channel_id)
+        await interaction.response.send_message("Session en pause", ephemeral=True)
+
+    @app_commands.command(description="Ajoute une question à la banque de questions")
+    @app_commands.describe(question="la question", answers="réponses, séparées par des virgules, les membres du salon par défaut")
+    async def question(self, interaction: discord.Interaction, question: str, answers: Optional[str] = None):
+        try:
+            await self.client.add_question(question, answers=split_list(answers))
+        except DuplicateKeyError:
+            await interaction.response.send_message("Cette question existe déjà !", ephemeral=True)
+            return
+        await interaction.response.send_message("J'ai bien ajouté ta question !", ephemeral=True)
+
+    @app_commands.command(description="Statistiques de la session de ce salon, ou d'un membre")
+    @app_commands.describe(member="membre dont afficher les statistiques")
+    @app_commands.guild_only()
+    async def stats(self, interaction: discord.Interaction, member: Optional[discord.Member] = None):
+        if member is not None:
+            stats = await self.client.get_member_stats(interaction.channel_id, member.id)
+            if stats is None:
+                await interaction.response.send_message(f"{member.display_name} n'a pas encore de statistiques", ephemeral=True)
+                return
+            await interaction.response.send_message(
+                f"{member.display_name} : {stats.get('polls_voted', 0)} sondage(s) votés, "
+                f"{stats.get('votes_received', 0)} vote(s) reçus, {stats.get('polls_won', 0)} sondage(s) remportés",
+                ephemeral=True,
+            )
+            return
+        stats = await self.client.get_session_stats(interaction.channel_id)
+        if stats is None:
+            await interaction.response.send_message("Aucun sondage de cette session n'est encore clos", ephemeral=True)
+            return
+        names = await self.client.get_name_map(interaction.channel)
+        embed = discord.Embed(title="Statistiques", description=f"{stats['polls']} sondage(s), {stats['votes']} vote(s)")
+        for title, ranking, field in (
+            ("Les plus actifs", stats["most_active"], "polls_voted"),
+            ("Les plus votés", stats["most_voted"], "votes_received"),
+        ):
+            lines = []
+            for entry in ranking:
+                member_id = entry["member_id"]
+                lines.append(f"{names.get(member_id, f'<@{member_id}>')} : {entry.get(field, 0)}")
+            if lines:
+                embed.add_field(name=title, value="\n".join(lines), inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="import", description="Importe des questions depuis un fichier jsonl ou csv")
+    @app_commands.describe(file='jsonl de {"question": ..., "answers": [...]} ou csv avec les colonnes question et answers (séparées par |)')
+    async def import_(self, interaction: discord.Interaction, file: discord.Attachment):
+        # the bank is shared by every server, only the owner of the bot can fill it in bulk
+        if not await self.client.is_owner(interaction.user):
+            await interaction.response.send_message("Seul le propriétaire du bot peut importer des questions", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        last_report = time.monotonic()
+
+        def progress(stats: Dict[str, int]):
+            nonlocal last_report
+            if time.monotonic() - last_report > 2.0:
+                last_report = time.monotonic()
+                asyncio.create_task(interaction.edit_original_response(content=f"Import en cours : {stats}"))
+
+        # the file is parsed as it downloads, it is never held in memory as a whole
+        async with aiohttp.ClientSession() as session:
+            async with session.get(file.url) as response:
+                response.raise_for_status()
+                stats = await import_questions(
+                    self.client.question_collection, parse_questions(response.content, format_of(file.filename)), progress=progress
+                )
+        await interaction.edit_original_response(
+            content=f"{stats['inserted']} questions importées, {stats['duplicates']} déjà présentes, {stats['invalid']} invalides"
+        )
+
+    @app_commands.command(description="Exporte la banque de questions")
+    @app_commands.choices(format=[app_commands.Choice(name="jsonl", value="jsonl"), app_commands.Choice(name="csv", value="csv")])
+    @app_commands.default_permissions(manage_guild=True)
+    async def export(self, interaction: discord.Interaction, format: Optional[app_commands.Choice[str]] = None):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        extension = format.value if format else "jsonl"
+        # written to disk batch by batch rather than built in memory
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"questions.{extension}")
+            with open(path, "w", encoding="utf-8", newline="") as output:
+                exported = await export_questions(self.client.question_collection, output.write, extension)
+            await interaction.followup.send(f"{exported} questions", file=discord.File(path), ephemeral=True)
+
+
+def command_help(tree: app_commands.CommandTree) -> str:
+    """One line per command of the tree, with its options"""
+    lines: Dict[str, str] = {}
+    for command in tree.walk_commands():
+        if isinstance(command, app_commands.Command):
+            usage = [f"/{command.qualified_name}"] + [
+                parameter.name if parameter.required else f"[{parameter.name}]" for parameter in command.parameters
+            ]
+            lines[command.qualified_name] = f"{' '.join(usage)} : {command.description}"
+    return "\n".join(lines[name] for name in sorted(lines))
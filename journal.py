@@ -0,0 +1,56 @@
+import sqlite3
+from typing import Iterator, Tuple
+
+
+class VoteJournal:
+    """Append only journal of the votes, in a sqlite database in WAL mode. A vote is durable as soon as it is
+    recorded, the journal is compacted once the votes are written to the database and replayed on startup
+    """
+
+    def __init__(self, path: str = "votes.journal"):
+        """
+        Args:
+            path (str, optional): file of the journal, ":memory:" for a journal that does not survive the process.
+                Defaults to "votes.journal".
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # with WAL, NORMAL survives a crash of the process, only a power loss can drop the last votes
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS votes "
+            "(seq INTEGER PRIMARY KEY AUTOINCREMENT, poll_id INTEGER, voter INTEGER, answer TEXT, removed INTEGER DEFAULT 0)"
+        )
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(votes)")]
+        if "removed" not in columns:
+            # journals written before vote removals were journaled
+            self.connection.execute("ALTER TABLE votes ADD COLUMN removed INTEGER DEFAULT 0")
+        self.last_seq = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM votes").fetchone()[0]
+
+    def record(self, poll_id: int, voter: int, answer: str, removed: bool = False) -> int:
+        """Appends a vote, or the removal of a vote, to the journal
+
+        Returns:
+            int: sequence number of the vote
+        """
+        cursor = self.connection.execute(
+            "INSERT INTO votes (poll_id, voter, answer, removed) VALUES (?, ?, ?, ?)", (poll_id, voter, answer, int(removed))
+        )
+        self.last_seq = cursor.lastrowid
+        return self.last_seq
+
+    def replay(self) -> Iterator[Tuple[int, int, str, bool]]:
+        """Votes of the journal in the order they were recorded, as (poll_id, voter, answer, removed)"""
+        for poll_id, voter, answer, removed in self.connection.execute("SELECT poll_id, voter, answer, removed FROM votes ORDER BY seq"):
+            yield poll_id, voter, answer, bool(removed)
+
+    def compact(self, up_to_seq: int) -> None:
+        """Drops the votes up to up_to_seq, once they are written to the database"""
+        self.connection.execute("DELETE FROM votes WHERE seq <= ?", (up_to_seq,))
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM votes").fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+
+from storage import Collection, DuplicateKeyError
+
+TZ = timezone.utc
+
+
+class LeaseManager:
+    """Leases stored in the database, so that a piece of background work shared by several workers is done by
+    exactly one of them. A lease belongs to its owner until it expires or is released
+    """
+
+    def __init__(self, collection: Collection, owner: str):
+        """
+        Args:
+            collection (Collection): collection storing the leases
+            owner (str): unique name of this worker
+        """
+        self.collection = collection
+        self.owner = owner
+
+    async def acquire(self, key: str, ttl: timedelta) -> bool:
+        """Takes the lease key for ttl, or extends it if this worker already holds it
+
+        Returns:
+            bool: Wether this worker holds the lease
+        """
+        now = datetime.now(tz=TZ)
+        try:
+            await self.collection.find_one_and_update(
+                {"_id": key, "$or": [{"owner": self.owner}, {"expires": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires": now + ttl}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # the lease exists and belongs to another worker
+            return False
+        return True
+
+    async def release(self, key: str) -> None:
+        await self.collection.delete_many({"_id": key, "owner": self.owner})
@@ -0,0 +1,489 @@
+import argparse
+import asyncio
+import gc
+import itertools
+import random
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, List
+
+import discord
+
+from askus_discord import AskUsClient
+from questionbank import next_ordinal, question_doc
+from results import ResultsRenderer
+from schema import ensure_schema
+from storage import Collection
+from tally import PollTally
+
+TZ = timezone.utc
+
+# discord-like rate limits, as (calls, seconds) per bucket
+RATE_LIMITS = {
+    "send": (5, 5.0),
+    "edit": (5, 5.0),
+    "reaction": (1, 0.25),
+    "delete": (5, 1.0),
+    "thread": (5, 5.0),
+}
+GLOBAL_RATE_LIMIT = (50, 1.0)
+
+
+class FakeRest:
+    """Fake discord REST layer: every call takes latency seconds and is counted, buckets over their limit answer
+    with a 429 and the call waits for the bucket to reset, as discord.py does
+    """
+
+    def __init__(self, latency: float = 0.01):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.rate_limited: Counter = Counter()
+        self.windows: Dict[tuple, List[float]] = {}
+        self.ids = itertools.count(discord.utils.time_snowflake(datetime.now(tz=TZ)))
+
+    def new_id(self) -> int:
+        return next(self.ids)
+
+    async def _wait_bucket(self, key: tuple, limit: int, period: float) -> None:
+        loop = asyncio.get_running_loop()
+        window = self.windows.setdefault(key, [])
+        while True:
+            now = loop.time()
+            window[:] = [t for t in window if now - t < period]
+            if len(window) < limit:
+                window.append(now)
+                return
+            self.rate_limited[key[0]] += 1
+            await asyncio.sleep(period - (now - window[0]))
+
+    async def call(self, route: str, major_id: int) -> None:
+        await self._wait_bucket(("global",), *GLOBAL_RATE_LIMIT)
+        await self._wait_bucket((route, major_id), *RATE_LIMITS[route])
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+class FakeGuild:
+    """Guild whose members are only created when chunked, as discord.py fills its member cache"""
+
+    def __init__(self, rest: FakeRest, member_count: int):
+        self.rest = rest
+        self.id = rest.new_id()
+        self.member_count = member_count
+        self.member_ids = [rest.new_id() for _ in range(member_count)]
+        self.members: List[FakeMember] = []
+
+    @property
+    def chunked(self) -> bool:
+        return len(self.members) == self.member_count
+
+    def load_members(self) -> None:
+        self.members = [FakeMember(member_id, self) for member_id in self.member_ids]
+
+    async def chunk(self) -> List["FakeMember"]:
+        # the gateway sends members by chunks of 1000
+        await asyncio.sleep(-(-self.member_count // 1000) * self.rest.latency)
+        self.load_members()
+        return self.members
+
+    def _remove_member(self, member: "FakeMember") -> None:
+        self.members.remove(member)
+
+
+class FakeMember:
+    def __init__(self, member_id: int, guild):
+        self.id = member_id
+        self.guild = guild
+        self.bot = False
+        self.display_name = f"member{member_id}"
+
+
+class FakeMessage:
+    def __init__(self, rest: FakeRest, channel: "FakeChannel", message_id: int):
+        self.rest = rest
+        self.channel = channel
+        self.id = message_id
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        await self.rest.call("reaction", self.channel.id)
+
+    async def remove_reaction(self, emoji, member):
+        await self.rest.call("reaction", self.channel.id)
+
+    async def edit(self, **kwargs):
+        await self.rest.call("edit", self.channel.id)
+
+    async def delete(self):
+        await self.rest.call("delete", self.channel.id)
+
+    async def create_thread(self, name: str):
+        await self.rest.call("thread", self.channel.id)
+        return self.channel.sim.channel(self.id, self.channel.guild)
+
+
+class FakeChannel:
+    def __init__(self, sim: "Simulation", channel_id: int, guild):
+        self.sim = sim
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"channel{channel_id}"
+        self.type = discord.ChannelType.text
+
+    @property
+    def members(self) -> List[FakeMember]:
+        return self.guild.members if self.guild is not None else []
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        await self.sim.rest.call("send", self.id)
+        return FakeMessage(self.sim.rest, self, self.sim.rest.new_id())
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self.sim.rest, self, message_id)
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self.sim.rest.call("send", self.id)
+        return FakeMessage(self.sim.rest, self, message_id)
+
+    async def delete_messages(self, messages):
+        await self.sim.rest.call("delete", self.id)
+
+    def permissions_for(self, member):
+        return SimpleNamespace(read_messages=True)
+
+
+class CountingCollection:
+    """Counts the operations made on a collection"""
+
+    def __init__(self, collection: Collection, counter: Counter, name: str):
+        self.collection = collection
+        self.counter = counter
+        self.name = name
+
+    def __getattr__(self, attribute):
+        method = getattr(self.collection, attribute)
+        if attribute == "find_batches":
+            self.counter[self.name] += 1
+            return method
+
+        async def counted(*args, **kwargs):
+            self.counter[self.name] += 1
+            return await method(*args, **kwargs)
+
+        return counted
+
+
+class Simulation:
+    """AskUsClient wired to the fake REST layer and an in memory database, fed with synthetic gateway events"""
+
+    def __init__(
+        self,
+        guilds: int = 10,
+        channels_per_guild: int = 5,
+        members_per_guild: int = 200,
+        latency: float = 0.01,
+        lazy_members: bool = False,
+    ):
+        """
+        Args:
+            lazy_members (bool, optional): Wether members are fetched on demand, otherwise every guild is chunked
+                when the simulation is built, as at the startup of the bot. Defaults to False.
+        """
+        self.rest = FakeRest(latency=latency)
+        self.db_ops: Counter = Counter()
+        intents = discord.Intents.default()
+        intents.members = True
+        self.client = AskUsClient(
+            intents=intents, db_url="memory://", journal_path=":memory:", render_window=0.5,
+            lazy_members=lazy_members,
+        )
+        self.client.setup_database()
+        for attribute, value in list(vars(self.client).items()):
+            if isinstance(value, Collection):
+                setattr(self.client, attribute, CountingCollection(value, self.db_ops, attribute))
+        self.client.leases.collection = CountingCollection(self.client.leases.collection, self.db_ops, "leases")
+
+        self.channels: Dict[int, FakeChannel] = {}
+        self.text_channel_ids: List[int] = []
+        self.guilds: Dict[int, FakeGuild] = {}
+        for _ in range(guilds):
+            guild = FakeGuild(self.rest, members_per_guild)
+            self.guilds[guild.id] = guild
+            if not lazy_members:
+                guild.load_members()
+            for _ in range(channels_per_guild):
+                self.text_channel_ids.append(self.channel(self.rest.new_id(), guild).id)
+        self.client.get_channel = self.channels.get
+        self.client.get_guild = self.guilds.get
+        self.client._connection.user = SimpleNamespace(id=0)
+        # the fake gateway has nothing to wait for, the client is ready from the start
+        self.client._ready = asyncio.Event()
+        self.client._ready.set()
+        self.client.get_partial_messageable = lambda channel_id, **kwargs: self.channels.get(channel_id) or self.channel(channel_id, None)
+
+    def channel(self, channel_id: int, guild) -> FakeChannel:
+        channel = self.channels[channel_id] = FakeChannel(self, channel_id, guild)
+        return channel
+
+    def text_channels(self) -> List[FakeChannel]:
+        return [self.channels[channel_id] for channel_id in self.text_channel_ids]
+
+    async def drain(self) -> None:
+        """Waits for the pending renders and flushes the votes. Reaction removals are left running, their backlog
+        is part of the report
+        """
+        while self.client.render_scheduler.tasks:
+            await asyncio.sleep(0.05)
+        await self.client.flush_votes()
+
+    def close(self) -> None:
+        for task in list(self.client.reaction_removals.workers.values()):
+            task.cancel()
+
+    def reset_counters(self) -> None:
+        self.rest.calls.clear()
+        self.rest.rate_limited.clear()
+        self.db_ops.clear()
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(name: str, sim: Simulation, wall: float, latencies: List[float] = None, **extra) -> Dict[str, float]:
+    current, peak = tracemalloc.get_traced_memory()
+    result = {
+        "wall_s": round(wall, 3),
+        "rest_calls": sim.rest.total_calls,
+        "rate_limited": sum(sim.rest.rate_limited.values()),
+        "db_ops": sum(sim.db_ops.values()),
+        "peak_mb": round(peak / 2**20, 1),
+    }
+    if latencies is not None:
+        result["handler_p50_ms"] = round(percentile(latencies, 0.5) * 1000, 3)
+        result["handler_p99_ms"] = round(percentile(latencies, 0.99) * 1000, 3)
+    result.update(extra)
+    print(f"{name:16} " + "  ".join(f"{key}={value}" for key, value in result.items()))
+    return result
+
+
+async def reaction_storm(sim: Simulation, polls: int = 10, votes: int = 2000) -> Dict[str, float]:
+    """Many members voting on a few homemade polls at once"""
+    channels = sim.text_channels()
+    answers = {key: f"answer {key}" for key in range(12)}
+    poll_channels = [channels[index % len(channels)] for index in range(polls)]
+    created = await asyncio.gather(
+        *(sim.client.send_poll(channel, "question ?", answers, mode=sim.client.CUSTOM, duration=timedelta(hours=1)) for channel in poll_channels)
+    )
+    poll_ids = list(zip(created, poll_channels))
+    sim.reset_counters()
+    tracemalloc.reset_peak()
+    emojis = sim.client.get_emoji_AtoZ(12)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(votes):
+        poll_id, channel = random.choice(poll_ids)
+        member = random.choice(channel.members)
+        payload = SimpleNamespace(
+            message_id=poll_id, channel_id=channel.id, user_id=member.id, member=member,
+            emoji=discord.PartialEmoji(name=random.choice(emojis)),
+        )
+        event_start = time.perf_counter()
+        await sim.client.on_raw_reaction_add(payload)
+        latencies.append(time.perf_counter() - event_start)
+        await asyncio.sleep(0)
+    await sim.drain()
+    wall = time.perf_counter() - start
+    removals = sim.client.reaction_removals.stats()
+    # removals run at discord's reaction rate and are still queued here, each of them is at least one more call
+    return report(
+        "reaction_storm", sim, wall, latencies,
+        rest_per_vote=round((sim.rest.total_calls + removals["depth"]) / votes, 3), **sim.client.render_scheduler.stats(),
+        removal_depth=removals["depth"], removal_lag_s=round(removals["lag"], 3),
+    )
+
+
+async def askus_tick(sim: Simulation, questions: int = 2000) -> Dict[str, float]:
+    """Every channel having an askus session due at the same time"""
+    for index in range(questions):
+        await sim.client.question_collection.insert_one(question_doc(f"question {index}", ["a", "b", "c", "d"], index))
+    for channel in sim.text_channels():
+        await sim.client.start_askus(channel.id)
+    sim.reset_counters()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    await sim.client.check_askus()
+    wall = time.perf_counter() - start
+    return report("askus_tick", sim, wall, **{f"askus_{key}": round(value, 3) for key, value in sim.client.askus_stats.items()})
+
+
+async def askus_bank(sim: Simulation, questions: int = 100_000, asked: int = 50_000, picks: int = 20) -> Dict[str, float]:
+    """Question picks of every channel's session from a large bank, each session having already asked asked
+    questions. A pick should cost the same whatever the size of the bank and the number of questions asked
+    """
+    await ensure_schema(sim.client.database, ["questions"])
+    for start in range(0, questions, 1000):
+        await sim.client.question_collection.insert_many(
+            [question_doc(f"question {index}", ["a", "b", "c", "d"], index) for index in range(start, min(start + 1000, questions))]
+        )
+    sessions = []
+    for channel in sim.text_channels():
+        await sim.client.start_askus(channel.id)
+        session = await sim.client.askus_collection.find_one({"_id": channel.id})
+        session.update(pass_start=0, pass_end=questions, position=asked)
+        sessions.append(session)
+    sim.reset_counters()
+    tracemalloc.reset_peak()
+    latencies = []
+    first_questions = set()
+    start = time.perf_counter()
+    bank_size = await next_ordinal(sim.client.question_collection)
+    for session in sessions:
+        for index in range(picks):
+            pick_start = time.perf_counter()
+            question, remaining, progress = await sim.client.pick_question(session, bank_size)
+            latencies.append(time.perf_counter() - pick_start)
+            session.update(progress)
+            if index == 0:
+                first_questions.add(question["_id"])
+    wall = time.perf_counter() - start
+    return report(
+        "askus_bank", sim, wall, latencies, picks=len(latencies),
+        db_ops_per_pick=round(sum(sim.db_ops.values()) / len(latencies), 3),
+        distinct_first_questions=f"{len(first_questions)}/{len(sessions)}", remaining=remaining - 1,
+    )
+
+
+async def mass_close(sim: Simulation, polls: int = 500) -> Dict[str, float]:
+    """Many homemade polls expiring at the same time, as after a restart"""
+    channels = sim.text_channels()
+    past = datetime.now(tz=TZ) - timedelta(minutes=1)
+    for index in range(polls):
+        doc = {
+            "_id": sim.rest.new_id(), "results_id": sim.rest.new_id(), "channel_id": channels[index % len(channels)].id,
+            "close_time": past, "native": False, "question": "question ?", "answers": {"0": "a", "1": "b"},
+            "emojis": {"0": "🇦", "1": "🇧"}, "results": {},
+        }
+        await sim.client.active_poll_collection.insert_one(doc)
+    await sim.client.load_active_polls()
+    sim.reset_counters()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    closed = await sim.client.close_polls()
+    wall = time.perf_counter() - start
+    return report("mass_close", sim, wall, closed=closed, db_ops_per_poll=round(sum(sim.db_ops.values()) / polls, 2))
+
+
+async def tally_cost(sim: Simulation, votes: int = 10000) -> Dict[str, float]:
+    """Cost of a vote as the number of voters of the poll grows, it should stay flat"""
+    costs = {}
+    keys = [str(key) for key in range(10)]
+    for voters in (10, 100, 1000, 10000):
+        tally = PollTally(keys)
+        for voter in range(voters):
+            tally.vote(voter, keys[voter % 10])
+        start = time.perf_counter()
+        for index in range(votes):
+            tally.vote(index % voters, keys[(index * 7) % 10])
+        costs[f"vote_us_{voters}"] = round((time.perf_counter() - start) / votes * 1e6, 3)
+    print("tally_cost       " + "  ".join(f"{key}={value}" for key, value in costs.items()))
+    return costs
+
+
+async def render_cost(sim: Simulation, renders: int = 100) -> Dict[str, float]:
+    """Cost of rendering the results of a poll as its number of voters grows: a full render, and a render after a
+    single vote which should stay flat thanks to the cached answers
+    """
+    costs = {}
+    keys = [str(key) for key in range(10)]
+    for voters in (10, 100, 1000, 10000):
+        tally = PollTally(keys)
+        names = {voter: f"member{voter}" for voter in range(voters)}
+        for voter in range(voters):
+            tally.vote(voter, keys[voter % 10])
+        renderer = ResultsRenderer({key: f"answer {key}" for key in keys}, max_named_voters=voters)
+        start = time.perf_counter()
+        embed = renderer.render(tally, names)
+        costs[f"full_ms_{voters}"] = round((time.perf_counter() - start) * 1000, 3)
+        start = time.perf_counter()
+        for index in range(renders):
+            tally.vote(index % voters, keys[(index * 7) % 10])
+            embed = renderer.render(tally, names)
+        costs[f"vote_ms_{voters}"] = round((time.perf_counter() - start) / renders * 1000, 3)
+        costs[f"size_{voters}"] = len(embed)
+    print("render_cost      " + "  ".join(f"{key}={value}" for key, value in costs.items()))
+    return costs
+
+
+async def member_cache(sim: Simulation, guilds: int = 100, members: int = 500, active_guilds: int = 10) -> Dict[str, float]:
+    """Startup time and memory of the member cache policies for a deployment of guilds * members members where only
+    active_guilds guilds run polls. Builds its own deployments, the simulation given is not used
+    """
+    results = {}
+    for policy in ("full", "lazy"):
+        gc.collect()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        deployment = Simulation(guilds=guilds, members_per_guild=members, lazy_members=policy == "lazy")
+        if policy == "full":
+            # the bot waits for every guild to be chunked before it is ready
+            for guild in deployment.guilds.values():
+                await asyncio.sleep(-(-guild.member_count // 1000) * deployment.rest.latency)
+        for guild in list(deployment.guilds.values())[:active_guilds]:
+            channel = next(channel for channel in deployment.text_channels() if channel.guild is guild)
+            await deployment.client.start_askus(channel.id)
+        await deployment.client.warm_up()
+        await deployment.client.warm_name_maps()
+        results[f"{policy}_startup_s"] = round(time.perf_counter() - start, 3)
+        results[f"{policy}_members"] = sum(len(guild.members) for guild in deployment.guilds.values())
+        results[f"{policy}_mb"] = round((tracemalloc.get_traced_memory()[0] - before) / 2**20, 1)
+        if policy == "lazy":
+            # sessions stop, their guilds go idle and are evicted
+            for channel_id in list(deployment.client.session_channels):
+                await deployment.client.stop_askus(channel_id)
+            deployment.client.member_idle_time = 0
+            results["evicted_guilds"] = deployment.client.evict_idle_members()
+            results["members_after_eviction"] = sum(len(guild.members) for guild in deployment.guilds.values())
+        deployment.close()
+        del deployment
+    print("member_cache     " + "  ".join(f"{key}={value}" for key, value in results.items()))
+    return results
+
+
+SCENARIOS = {
+    "reaction_storm": reaction_storm,
+    "askus_tick": askus_tick,
+    "askus_bank": askus_bank,
+    "mass_close": mass_close,
+    "tally_cost": tally_cost,
+    "render_cost": render_cost,
+    "member_cache": member_cache,
+}
+
+
+async def main(args: argparse.Namespace) -> None:
+    tracemalloc.start()
+    for name in args.scenarios or SCENARIOS:
+        sim = Simulation(guilds=args.guilds, members_per_guild=args.members, latency=args.latency)
+        await SCENARIOS[name](sim)
+        sim.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load simulation of the poll and askus clients against a fake discord")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run among {', '.join(SCENARIOS)}, all by default")
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--members", type=int, default=200, help="members per guild")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds taken by each REST call")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,212 @@
+import asyncio
+import functools
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional
+
+PREFIX = "askus_"
+
+
+class Timer:
+    """Count, total and maximum of the durations of an operation"""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class _Timing:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class _NoTiming:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_TIMING = _NoTiming()
+
+
+class Metrics:
+    """Timers, counters and gauges of the bot, exported in the prometheus text format. When disabled, timing an
+    operation costs a single attribute check
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.timers: Dict[str, Timer] = defaultdict(Timer)
+        self.counters: Counter = Counter()
+        self.gauge_sources: List[Callable[[], Dict[str, float]]] = []
+
+    def timer(self, name: str):
+        """Context manager timing the block under name"""
+        return _Timing(self, name) if self.enabled else _NO_TIMING
+
+    def observe(self, name: str, seconds: float) -> None:
+        self.timers[name].observe(seconds)
+
+    def increment(self, name: str, value: float = 1) -> None:
+        if self.enabled:
+            self.counters[name] += value
+
+    def add_gauges(self, source: Callable[[], Dict[str, float]]) -> None:
+        """Adds a function returning gauges, called at each scrape"""
+        self.gauge_sources.append(source)
+
+    def render(self) -> str:
+        """Metrics in the prometheus text format"""
+        lines = []
+        for name, timer in sorted(self.timers.items()):
+            metric = _metric_name(name) + "_seconds"
+            lines += [
+                f"{metric}_count {timer.count}",
+                f"{metric}_sum {timer.total:.6f}",
+                f"{metric}_max {timer.max:.6f}",
+            ]
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{_metric_name(name)}_total {value}")
+        for source in self.gauge_sources:
+            for name, value in sorted(source().items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f"{_metric_name(name)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(name: str) -> str:
+    return PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name).strip("_")
+
+
+def timed(name: str):
+    """Decorator timing a coroutine method of a client under name, through the client's metrics"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            if not self.metrics.enabled:
+                return await func(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class TimedCollection:
+    """Collection wrapper timing every database call under db.<collection>.<operation>"""
+
+    def __init__(self, collection, metrics: Metrics, name: str):
+        self.collection = collection
+        self.metrics = metrics
+        self.name = name
+
+    def __getattr__(self, attribute):
+        method = getattr(self.collection, attribute)
+        if attribute == "find_batches" or not callable(method):
+            return method
+
+        async def timed_call(*args, **kwargs):
+            with self.metrics.timer(f"db.{self.name}.{attribute}"):
+                return await method(*args, **kwargs)
+
+        return timed_call
+
+
+async def measure_loop_lag(metrics: Metrics, interval: float = 0.5) -> None:
+    """Measures how late the event loop wakes a sleeping task, which is the time handlers hold the loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        metrics.observe("event_loop_lag", max(0.0, loop.time() - start - interval))
+
+
+async def sample_profile(seconds: float, interval: float = 0.005, top: int = 30) -> str:
+    """Samples the stack of the event loop thread from another thread for some seconds. Nothing runs when no profile
+    is requested
+
+    Returns:
+        str: the lines most often running, with their share of the samples
+    """
+    loop_thread = threading.get_ident()
+    samples: Counter = Counter()
+
+    def sample():
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            frame = sys._current_frames().get(loop_thread)
+            if frame is not None:
+                code = frame.f_code
+                samples[f"{code.co_filename}:{frame.f_lineno} {code.co_name}"] += 1
+            time.sleep(interval)
+
+    await asyncio.get_running_loop().run_in_executor(None, sample)
+    total = sum(samples.values()) or 1
+    return "\n".join(f"{count / total:6.1%} {location}" for location, count in samples.most_common(top)) + "\n"
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving /metrics, and /profile?seconds=N for a sampling profile of the event loop"""
+
+    def __init__(self, metrics: Metrics, host: str = "127.0.0.1", port: int = 9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+            if path.startswith("/profile"):
+                match = re.search(r"seconds=([0-9.]+)", path)
+                body = await sample_profile(min(float(match.group(1)) if match else 5.0, 60.0))
+            else:
+                body = self.metrics.render()
+            payload = body.encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode()
+                + payload
+            )
+            await writer.drain()
+        finally:
+            writer.close()
@@ -0,0 +1,105 @@
+import itertools
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+
+_versions = itertools.count(1)
+
+
+class ChannelNames:
+    """Names of the members of a channel, nicknames set for the channel take precedence over discord names. The
+    version changes with every name, so renders can tell wether names they formatted are stale
+    """
+
+    __slots__ = ("guild_id", "nicknames", "discord_names", "names", "version")
+
+    def __init__(self, guild_id: int, nicknames: Dict[str, str], discord_names: Dict[int, str]):
+        self.guild_id = guild_id
+        self.nicknames = dict(nicknames)
+        self.discord_names = dict(discord_names)
+        self.names = {member_id: self._name(member_id) for member_id in self.discord_names}
+        self.version = next(_versions)
+
+    def _name(self, member_id: int) -> str:
+        return self.nicknames.get(str(member_id), self.discord_names[member_id])
+
+    def set_member(self, member_id: int, name: str) -> None:
+        self.discord_names[member_id] = name
+        self.names[member_id] = self._name(member_id)
+        self.version = next(_versions)
+
+    def remove_member(self, member_id: int) -> None:
+        self.discord_names.pop(member_id, None)
+        self.names.pop(member_id, None)
+        self.version = next(_versions)
+
+    def set_nickname(self, member_id: int, nickname: str) -> None:
+        self.nicknames[str(member_id)] = nickname
+        if member_id in self.discord_names:
+            self.names[member_id] = nickname
+        self.version = next(_versions)
+
+
+class NameCache:
+    """LRU cache of the name maps of the channels, updated member by member from gateway events"""
+
+    def __init__(self, max_channels: int = 256):
+        """
+        Args:
+            max_channels (int, optional): maximum number of channels kept in the cache. Defaults to 256.
+        """
+        self.max_channels = max_channels
+        self.channels: "OrderedDict[int, ChannelNames]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, channel_id: int) -> Optional[Dict[int, str]]:
+        """Gets the name map of a channel, None if it is not cached. The map is shared and must not be modified"""
+        entry = self.channels.get(channel_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.channels.move_to_end(channel_id)
+        return entry.names
+
+    def put(self, channel_id: int, guild_id: int, nicknames: Dict[str, str], discord_names: Dict[int, str]) -> Dict[int, str]:
+        """Caches the name map of a channel, evicting the least recently used channel if the cache is full"""
+        entry = ChannelNames(guild_id, nicknames, discord_names)
+        self.channels[channel_id] = entry
+        self.channels.move_to_end(channel_id)
+        while len(self.channels) > self.max_channels:
+            self.channels.popitem(last=False)
+        return entry.names
+
+    def version(self, channel_id: int) -> int:
+        """Version of the name map of a channel, 0 if it is not cached"""
+        entry = self.channels.get(channel_id)
+        return entry.version if entry is not None else 0
+
+    def channels_of(self, guild_id: int) -> List[int]:
+        """Ids of the cached channels of a guild"""
+        return [channel_id for channel_id, entry in self.channels.items() if entry.guild_id == guild_id]
+
+    def set_member(self, channel_id: int, member_id: int, name: str) -> None:
+        entry = self.channels.get(channel_id)
+        if entry is not None:
+            entry.set_member(member_id, name)
+
+    def remove_member(self, channel_ids: Iterable[int], member_id: int) -> None:
+        for channel_id in channel_ids:
+            entry = self.channels.get(channel_id)
+            if entry is not None:
+                entry.remove_member(member_id)
+
+    def set_nickname(self, channel_id: int, member_id: int, nickname: str) -> None:
+        entry = self.channels.get(channel_id)
+        if entry is not None:
+            entry.set_nickname(member_id, nickname)
+
+    def evict_guild(self, guild_id: int) -> None:
+        for channel_id in self.channels_of(guild_id):
+            del self.channels[channel_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "channels": len(self.channels)}
@@ -1,15 +1,32 @@
 import discord
+from discord import app_commands
 from discord.ext import tasks
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
-import json
-from typing import List, Dict
-from pymongo import MongoClient
+from typing import Deque, List, Dict, Optional, Set
+from collections import deque
+import asyncio
 import os
+import socket
+from commands import PollCommands, command_help
+from journal import VoteJournal
+from leases import LeaseManager
+from metrics import Metrics, MetricsServer, TimedCollection, measure_loop_lag, timed
+from namecache import NameCache
+from ratelimit import BucketLimiter, TokenBucket
+from reactions import ReactionRemovalQueue
+from render import RenderScheduler
+from results import HEADER, ResultsRenderer
+from schema import ensure_schema
+from scheduler import DeadlineScheduler
+from storage import DuplicateKeyError, open_database
+from tally import PollTally
 
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 TZ = timezone.utc
+# fields of the active polls left out of the archive, results are archived in their compact form
+ARCHIVE_DROPPED = {"results", "results_id", "emojis", "close_time"}
 
 
 class PollClient(discord.Client):
@@ -17,141 +34,590 @@ class PollClient(discord.Client):
     AUTO = 0
     CUSTOM = 1
     DISCORD = 2
-    COMMAND_PREFIX = "/poll"
+    COLLECTIONS = ["active_polls", "closed_polls", "nicknames", "leases"]
 
     def __init__(
         self,
         *args,
         db_url: str = "mongodb://localhost:27017/",
         db_name: str = "poll_db",
+        db_workers: int = 8,
+        render_window: float = 1.0,
+        flush_interval: float = 10.0,
+        name_cache_size: int = 256,
+        rest_rate: float = 40.0,
+        journal_path: str = None,
+        metrics_port: int = None,
+        max_named_voters: int = 1000,
+        lazy_members: bool = False,
+        member_idle_time: float = 3600.0,
         **kwargs,
     ):
         """Poll client for discord
 
         Args:
-            db_url (_type_, optional): url of the mongo database. Defaults to "mongodb://localhost:27017/".
+            db_url (_type_, optional): url of the mongo database, "memory://" for an in memory one. Defaults to "mongodb://localhost:27017/".
             poll_collection (str, optional): database page on which the data is stored. Defaults to "poll_db".
+            db_workers (int, optional): maximum number of database calls running at the same time. Defaults to 8.
+            render_window (float, optional): seconds during which votes are merged into a single results edit. Defaults to 1.0.
+            flush_interval (float, optional): seconds between two writes of the votes to the database. Defaults to 10.0.
+            name_cache_size (int, optional): number of channels whose name map is kept in memory. Defaults to 256.
+            rest_rate (float, optional): REST calls per second allowed to background work, below discord's global limit. Defaults to 40.0.
+            journal_path (str, optional): file of the vote journal, ":memory:" to disable durability. Defaults to votes.journal, suffixed by the first shard id when sharded.
+            metrics_port (int, optional): local port of the metrics endpoint, None to disable the instrumentation. Defaults to None.
+            max_named_voters (int, optional): voters above which homemade poll results show counts only. Defaults to 1000.
+            lazy_members (bool, optional): Wether to skip downloading every member at startup, members of a guild are
+                fetched when one of its channels needs names and dropped once it has been idle. Defaults to False.
+            member_idle_time (float, optional): seconds after which the members of a guild without active polls or
+                sessions are dropped, with lazy_members. Defaults to 3600.0.
         """
+        if lazy_members:
+            kwargs.setdefault("chunk_guilds_at_startup", False)
+            # members are only kept from chunk requests and gateway events, voice states do not add any
+            member_cache_flags = discord.MemberCacheFlags.from_intents(kwargs["intents"])
+            member_cache_flags.voice = False
+            kwargs.setdefault("member_cache_flags", member_cache_flags)
         super().__init__(*args, **kwargs)
         self.db_url = db_url
         self.db_name = db_name
-        self.db_client: MongoClient = None
+        self.db_workers = db_workers
         self.database = None
         self.active_poll_collection = None
         self.nickname_collection = None
+        self.closed_poll_collection = None
+        self.render_scheduler = RenderScheduler(window=render_window)
+        self.flush_interval = flush_interval
+        self.active_polls: Dict[int, dict] = {}  # active polls by message id, mirror of active_poll_collection
+        self.dirty_polls: Set[int] = set()  # polls with votes not written to the database yet
+        self.tallies: Dict[int, PollTally] = {}  # vote counts of the active polls
+        self.emoji_maps: Dict[int, Dict[str, str]] = {}  # emoji key to answer key of the homemade active polls
+        self.unresolved_polls: Set[int] = set()  # polls stored without guild id, whose worker is unknown until ready
+        self.result_renderers: Dict[int, ResultsRenderer] = {}  # results embeds of the homemade active polls
+        self.max_named_voters = max_named_voters
+        self.lazy_members = lazy_members
+        self.member_idle_time = member_idle_time
+        self.member_requests: Dict[int, asyncio.Task] = {}  # member downloads in progress, by guild id
+        self.guilds_used: Dict[int, float] = {}  # last time the members of a guild were needed, by guild id
+        self.name_cache = NameCache(max_channels=name_cache_size)
+        self.close_scheduler = DeadlineScheduler(self.close_poll)
+        self.rest_limiter = TokenBucket(rate=rest_rate, burst=int(rest_rate))
+        self.reaction_limiter = BucketLimiter(rate=4, burst=1)  # discord allows about one reaction per 0.25s per channel
+        self.reaction_removals = ReactionRemovalQueue(self.reaction_limiter, self.rest_limiter)
+        self.first_vote_pending: Dict[int, float] = {}  # creation time of the polls without votes yet
+        self.first_vote_latencies: Deque[float] = deque(maxlen=100)  # seconds from poll creation to first valid vote
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.journal_path = journal_path
+        self.journal: VoteJournal = None
+        self.startup_stats: Dict[str, float] = {}
+        self.leases: LeaseManager = None
+        self.metrics = Metrics(enabled=metrics_port is not None)
+        self.metrics_port = metrics_port
+        self.metrics_server: MetricsServer = None
+        self.tree = app_commands.CommandTree(self)
+        self.tree.add_command(PollCommands(self))
 
     def setup_database(self) -> None:
-        self.db_client: MongoClient = MongoClient(self.db_url)
-        self.database = self.db_client.get_database(self.db_name)
-        self.active_poll_collection = self.database.get_collection("active_polls")
-        self.nickname_collection = self.database.get_collection("nicknames")
+        self.database = open_database(self.db_url, self.db_name, max_workers=self.db_workers)
+        self.active_poll_collection = self.open_collection("active_polls")
+        self.nickname_collection = self.open_collection("nicknames")
+        self.closed_poll_collection = self.open_collection("closed_polls")
+        self.leases = LeaseManager(self.open_collection("leases"), self.worker_id)
+        if self.journal_path is None:
+            shard_ids = getattr(self, "shard_ids", None)
+            self.journal_path = f"votes-{shard_ids[0]}.journal" if shard_ids else "votes.journal"
+        self.journal = VoteJournal(self.journal_path)
+
+    def open_collection(self, name: str):
+        """Collection of the database, timed when the metrics are enabled"""
+        collection = self.database.get_collection(name)
+        return TimedCollection(collection, self.metrics, name) if self.metrics.enabled else collection
 
     def run(self, *args, **kwargs):
         self.setup_database()
         super().run(*args, **kwargs)
 
+    async def close(self) -> None:
+        self.close_scheduler.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        # reactions left on a poll are counted as votes at the next start, the pending removals go out first
+        await self.reaction_removals.drain(timeout=10)
+        await super().close()
+        if self.database is not None:
+            await self.flush_votes()
+            self.database.close()
+            self.journal.close()
+
     async def setup_hook(self) -> None:
-        self.my_background_task.start()
+        if self.metrics.enabled:
+            await self.start_metrics()
+        await self.ensure_indexes()
+        await self.warm_up()
+        self.flush_task.change_interval(seconds=self.flush_interval)
+        self.flush_task.start()
+        self.close_scheduler.start()
+        if self.lazy_members:
+            self.evict_members_task.start()
+        asyncio.create_task(self.reconcile())
+        asyncio.create_task(self.warm_name_maps())
+        if self.syncs_commands():
+            await self.tree.sync()
+
+    def syncs_commands(self) -> bool:
+        """Wether this worker publishes the application commands, only the one running shard 0 does when sharded"""
+        shard_ids = getattr(self, "shard_ids", None)
+        return shard_ids is None or 0 in shard_ids
+
+    async def start_metrics(self) -> None:
+        """Times the REST calls, measures the event loop lag and serves the metrics on metrics_port"""
+        request = self.http.request
+
+        async def timed_request(route, **kwargs):
+            with self.metrics.timer(f"rest.{route.method} {route.path}"):
+                try:
+                    return await request(route, **kwargs)
+                except discord.HTTPException as e:
+                    self.metrics.increment(f"rest_errors.{e.status}")
+                    raise
+
+        self.http.request = timed_request
+        self.metrics.add_gauges(self.metric_gauges)
+        asyncio.create_task(measure_loop_lag(self.metrics))
+        self.metrics_server = MetricsServer(self.metrics, port=self.metrics_port)
+        await self.metrics_server.start()
+        print(f"Metrics served on http://127.0.0.1:{self.metrics_port}/metrics")
+
+    def metric_gauges(self) -> Dict[str, float]:
+        """Current state of the components of the client, exported with the metrics"""
+        gauges = {
+            "active_polls": len(self.active_polls),
+            "dirty_polls": len(self.dirty_polls),
+            "scheduled_closes": len(self.close_scheduler),
+            "rest_limiter_waited_seconds": self.rest_limiter.waited,
+            "first_vote_latency_max_seconds": max(self.first_vote_latencies, default=0.0),
+            "cached_members": sum(len(guild.members) for guild in self.guilds),
+            "member_guilds": len(self.guilds_used),
+        }
+        components = {
+            "render": self.render_scheduler.stats(),
+            "name_cache": self.name_cache.stats(),
+            "reaction_removals": self.reaction_removals.stats(),
+            "reaction_limiter": self.reaction_limiter.stats(),
+            "startup": self.startup_stats,
+        }
+        for component, stats in components.items():
+            gauges.update({f"{component}_{key}": value for key, value in stats.items()})
+        return gauges
+
+    async def ensure_indexes(self):
+        """Creates the indexes of the collections of the client"""
+        await ensure_schema(self.database, self.COLLECTIONS)
+
+    async def warm_up(self) -> None:
+        """Rebuilds the in memory state before the bot starts handling events: loads the active polls and replays the
+        vote journal, reporting the time it took. The polls that expired while the bot was offline are closed in the
+        background by close_scheduler, where they are scheduled with a passed deadline
+        """
+        start = asyncio.get_running_loop().time()
+        await self.load_active_polls()
+        replayed = self.replay_journal()
+        now = datetime.now(tz=TZ)
+        self.startup_stats = {
+            "polls": len(self.active_polls),
+            "replayed_votes": replayed,
+            "overdue_polls": sum(1 for doc in self.active_polls.values() if doc["close_time"] < now),
+            "time_to_ready": asyncio.get_running_loop().time() - start,
+        }
+        print(f"Ready in {self.startup_stats['time_to_ready']:.3f}s : {self.startup_stats}")
+
+    def warm_channel_ids(self) -> Set[int]:
+        """Channels whose name map is needed soon"""
+        return {doc["channel_id"] for doc in self.active_polls.values() if not doc["native"]}
+
+    async def warm_name_maps(self, concurrency: int = 8) -> None:
+        """Fills the name cache of the channels returned by warm_channel_ids once the member cache is ready"""
+        await self.wait_until_ready()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def warm(channel_id: int):
+            channel = self.get_channel(channel_id)
+            if channel is not None:
+                async with slots:
+                    await self.get_name_map(channel)
+
+        await asyncio.gather(*(warm(channel_id) for channel_id in self.warm_channel_ids()), return_exceptions=True)
 
     async def on_ready(self):
         print(f"Logged in as {self.user} (ID: {self.user.id})")
         print("------")
 
-    @tasks.loop(seconds=30)
-    async def my_background_task(self):
-        await self.close_polls()
+    @tasks.loop(seconds=10)
+    async def flush_task(self):
+        try:
+            await self.flush_votes()
+        except Exception as e:
+            # the polls stay dirty and the journal keeps their votes, the next tick writes them
+            print(f"Failed to write votes : {e}")
+
+    async def load_active_polls(self):
+        """Loads every active poll of the database in the in memory index"""
+        self.active_polls = {}
+        self.tallies = {}
+        self.emoji_maps = {}
+        async for docs in self.active_poll_collection.find_batches():
+            for doc in docs:
+                if self.owns_guild(doc.get("guild_id")):
+                    self._remember_poll(doc)
 
-    @my_background_task.before_loop
-    async def before_my_task(self):
+    def worker_shard_ids(self) -> Optional[List[int]]:
+        """Shards handled by this worker, None when not sharded"""
+        shard_ids = getattr(self, "shard_ids", None)
+        if shard_ids is None and self.shard_id is not None:
+            shard_ids = [self.shard_id]
+        return shard_ids if self.shard_count else None
+
+    def owns_guild(self, guild_id: Optional[int]) -> bool:
+        """Wether the guild is handled by the shards of this worker, always True when not sharded or when the guild
+        is unknown (polls created before guild ids were stored, see resolve_poll_guilds)
+        """
+        shard_ids = self.worker_shard_ids()
+        if guild_id is None or shard_ids is None:
+            return True
+        return (guild_id >> 22) % self.shard_count in shard_ids
+
+    async def resolve_poll_guilds(self) -> int:
+        """Finds the guild of the polls stored without guild id, once the channels are cached. A sharded worker only
+        caches the channels of its own guilds: it keeps the polls found there, stores their guild id and schedules
+        their close, and drops the others, so a poll is never closed by a worker whose tally does not receive its
+        votes. Polls whose channel is gone are kept by the worker running shard 0
+
+        Returns:
+            int: number of polls kept
+        """
+        if not self.unresolved_polls:
+            return 0
         await self.wait_until_ready()
+        updates = []
+        for poll_id in list(self.unresolved_polls):
+            doc = self.active_polls[poll_id]
+            channel = self.get_channel(doc["channel_id"])
+            if channel is None and not (self.syncs_commands() and await self._channel_deleted(doc["channel_id"])):
+                self._forget_poll(poll_id)
+                continue
+            if channel is not None:
+                doc["guild_id"] = channel.guild.id
+                updates.append(({"_id": poll_id}, {"$set": {"guild_id": doc["guild_id"]}}))
+            self.unresolved_polls.discard(poll_id)
+            self.close_scheduler.schedule(poll_id, doc["close_time"])
+        await self.active_poll_collection.bulk_update(updates)
+        return len(updates)
 
-    async def on_message(self, message: discord.Message):
-        if message.author.id == self.user.id or message.author.bot:
-            return
-        if not message.content.startswith(self.COMMAND_PREFIX):
-            return
+    async def _channel_deleted(self, channel_id: int) -> bool:
+        await self.rest_limiter.acquire()
+        try:
+            await self.fetch_channel(channel_id)
+        except discord.NotFound:
+            return True
+        except discord.HTTPException:
+            pass
+        return False
 
-        new_content = message.content.removeprefix(self.COMMAND_PREFIX).strip()
-        if new_content.startswith("help"):
-            await message.channel.send("Sent you help in DM !")
-            if message.author.dm_channel is None:
-                await message.author.create_dm()
-            await message.author.dm_channel.send(self.get_help())
+    @timed("flush_votes")
+    async def flush_votes(self):
+        """Writes the results of every poll that received votes since the last flush in a single batch"""
+        if not self.dirty_polls:
             return
+        poll_ids, self.dirty_polls = self.dirty_polls, set()
+        # every journaled vote up to here is in the results written below
+        journal_seq = self.journal.last_seq
+        updates = [
+            ({"_id": poll_id}, {"$set": {"results": dict(self.active_polls[poll_id]["results"])}})
+            for poll_id in poll_ids
+            if poll_id in self.active_polls
+        ]
+        try:
+            await self.active_poll_collection.bulk_update(updates)
+        except Exception:
+            self.dirty_polls |= poll_ids
+            raise
+        self.journal.compact(journal_seq)
 
-        if new_content.startswith("create"):
-            new_content = new_content.removeprefix("create").strip()
-            try:
-                args, kwargs = json.loads(new_content).values()
-                await self.send_poll(message.channel, *args, **kwargs)
-            except Exception as e:
-                await message.channel.send(f"There was an error in your inputs : \n {e}\n Try /poll help !")
-                raise Exception(e)
-            return
+    def replay_journal(self) -> int:
+        """Applies the votes of the journal not written to the database yet, after a crash
 
-        if new_content.startswith("remove"):
-            poll_id = new_content.removeprefix("remove").strip()
-            doc = self.active_poll_collection.find_one({"_id": int(poll_id)})
-            if doc is not None and doc["channel_id"] == message.channel.id:
-                self.active_poll_collection.find_one_and_delete({"_id": int(poll_id)})
-                poll_message = await message.channel.fetch_message(poll_id)
-                await poll_message.delete()
-            return
+        Returns:
+            int: number of votes replayed
+        """
+        replayed = 0
+        for poll_id, voter, answer, removed in self.journal.replay():
+            if poll_id in self.tallies:
+                replayed += self._record_vote(poll_id, voter, answer, journal=False, removed=removed)
+        return replayed
 
-        if new_content.startswith("clear"):
-            docs = self.active_poll_collection.find({"channel_id": message.channel.id})
-            message_ids = [doc["_id"] for doc in docs]
-            for message_id in message_ids:
-                self.active_poll_collection.find_one_and_delete({"_id": message_id})
-                message_to_delete = await message.channel.fetch_message(message_id)
-                await message_to_delete.delete()
-            return
+    async def reconcile(self) -> None:
+        """Catches up on the votes cast while the bot was offline, once the polls of this worker are known"""
+        await self.resolve_poll_guilds()
+        await asyncio.gather(self.reconcile_reactions(), self.reconcile_native_votes())
 
-        if new_content.startswith("close"):
-            poll_id = new_content.removeprefix("close").strip()
-            doc = self.active_poll_collection.find_one({"_id": int(poll_id)})
-            if doc is not None and doc["channel_id"] == message.channel.id:
-                self.active_poll_collection.find_one_and_delete({"_id": int(poll_id)})
-            return
-        
-        if new_content.startswith("add_nick"):
-            poll_id = new_content.removeprefix("add_nick").strip()
-            member_id, nickname = new_content.split(" ", 1)
-            self.add_nickname(message.channel.id, member_id, nickname)      
+    async def reconcile_reactions(self, concurrency: int = 5) -> int:
+        """Counts the votes cast while the bot was offline. Vote reactions are removed once counted, so a reaction
+        left by a member who has no vote in the tally is a missed vote. Reactions of members already counted were
+        not removed in time (pending at shutdown, or given up) and are only removed: their vote in the tally is the
+        latest one, which the order of the reactions does not tell
 
-        if message.channel.type != discord.ChannelType.private:
-            return
+        Returns:
+            int: number of votes recovered
+        """
+        slots = asyncio.Semaphore(concurrency)
+        recovered = 0
+
+        async def reconcile(poll_id: int):
+            nonlocal recovered
+            doc = self.active_polls.get(poll_id)
+            if doc is None:
+                return
+            async with slots:
+                await self.rest_limiter.acquire()
+                try:
+                    poll_msg = await self.get_partial_messageable(doc["channel_id"]).fetch_message(poll_id)
+                except discord.NotFound:
+                    return
+            reacted: Dict[int, tuple] = {}  # user and their answer reactions, by user id
+            for reaction in poll_msg.reactions:
+                emoji = discord.PartialEmoji.from_str(str(reaction.emoji))
+                answer = self.emoji_maps.get(poll_id, {}).get(emoji_key(emoji))
+                if answer is None or reaction.count <= int(reaction.me):
+                    continue
+                async for user in reaction.users():
+                    if not user.bot:
+                        reacted.setdefault(user.id, (user, []))[1].append((emoji, answer))
+            tally = self.tallies.get(poll_id)
+            if tally is None:
+                return
+            for user, reactions in reacted.values():
+                # several answers mean the member changed their vote, in an order the reactions do not keep
+                if len(reactions) == 1 and user.id not in tally.choices:
+                    recovered += self._record_vote(poll_id, user.id, reactions[0][1])
+                for emoji, _ in reactions:
+                    self.reaction_removals.enqueue(poll_msg, emoji, user)
 
+        await asyncio.gather(*(reconcile(poll_id) for poll_id in list(self.emoji_maps)), return_exceptions=True)
+        return recovered
+
+    async def reconcile_native_votes(self, concurrency: int = 5) -> int:
+        """Catches up on the votes cast or removed on discord polls while the bot was offline, by comparing the
+        voters of each answer with the tally
+
+        Returns:
+            int: number of votes added or removed
+        """
+        slots = asyncio.Semaphore(concurrency)
+        changed = 0
+
+        async def reconcile(poll_id: int):
+            nonlocal changed
+            doc = self.active_polls.get(poll_id)
+            if doc is None:
+                return
+            async with slots:
+                await self.rest_limiter.acquire()
+                try:
+                    poll_msg = await self.get_partial_messageable(doc["channel_id"]).fetch_message(poll_id)
+                except discord.NotFound:
+                    return
+                if poll_msg.poll is None:
+                    return
+                for answer in poll_msg.poll.answers:
+                    key = str(answer.id)
+                    voters = set()
+                    if answer.vote_count:
+                        await self.rest_limiter.acquire()
+                        voters = {user.id async for user in answer.voters()}
+                    tally = self.tallies.get(poll_id)
+                    if tally is None or key not in tally.voters:
+                        continue
+                    for voter in voters - tally.voters[key]:
+                        changed += self._record_vote(poll_id, voter, key)
+                    for voter in tally.voters[key] - voters:
+                        changed += self._record_vote(poll_id, voter, key, removed=True)
+
+        native_ids = [poll_id for poll_id, doc in self.active_polls.items() if doc["native"]]
+        await asyncio.gather(*(reconcile(poll_id) for poll_id in native_ids), return_exceptions=True)
+        return changed
+
+    def _remember_poll(self, doc: dict) -> None:
+        self.active_polls[doc["_id"]] = doc
+        if doc.get("guild_id") is None and self.worker_shard_ids() is not None:
+            self.unresolved_polls.add(doc["_id"])
+        else:
+            self.close_scheduler.schedule(doc["_id"], doc["close_time"])
+        doc.setdefault("results", {})
+        self.tallies[doc["_id"]] = PollTally.from_results(doc["answers"].keys(), doc["results"], multiple=doc.get("multiple", False))
+        if not doc["native"]:
+            self.result_renderers[doc["_id"]] = ResultsRenderer(doc["answers"], max_named_voters=self.max_named_voters)
+            self.emoji_maps[doc["_id"]] = {
+                emoji_key(discord.PartialEmoji.from_str(emoji)): key for key, emoji in doc["emojis"].items()
+            }
+
+    def _forget_poll(self, poll_id: int) -> None:
+        self.active_polls.pop(poll_id, None)
+        self.tallies.pop(poll_id, None)
+        self.emoji_maps.pop(poll_id, None)
+        self.result_renderers.pop(poll_id, None)
+        self.dirty_polls.discard(poll_id)
+        self.close_scheduler.cancel(poll_id)
+        self.first_vote_pending.pop(poll_id, None)
+        self.unresolved_polls.discard(poll_id)
+
+    async def remove_poll(self, poll_id: int, channel_id: int) -> bool:
+        """Deletes an active poll of a channel, its message included, without closing it
+
+        Returns:
+            bool: Wether the poll was found
+        """
+        doc = self.active_polls.get(poll_id)
+        if doc is None or doc["channel_id"] != channel_id:
+            return False
+        self._forget_poll(poll_id)
+        await self.active_poll_collection.find_one_and_delete({"_id": poll_id})
+        try:
+            await self.get_partial_messageable(channel_id).get_partial_message(poll_id).delete()
+        except discord.NotFound:
+            pass
+        return True
+
+    async def clear_polls(self, channel: discord.TextChannel, concurrency: int = 5) -> int:
+        """Deletes every active poll of a channel. Records are removed in one query, messages younger than 14 days
+        are bulk deleted by 100 and older ones are deleted concurrently, progress being reported in the channel
+
+        Args:
+            channel (discord.TextChannel): channel to clear
+            concurrency (int, optional): maximum number of single message deletions at the same time. Defaults to 5.
+
+        Returns:
+            int: number of polls deleted
+        """
+        poll_ids = [doc["_id"] for doc in self.active_polls.values() if doc["channel_id"] == channel.id]
+        for poll_id in poll_ids:
+            self._forget_poll(poll_id)
+        await self.active_poll_collection.delete_many({"channel_id": channel.id})
+        if not poll_ids:
+            return 0
+
+        progress_message = await channel.send(f"Suppression de {len(poll_ids)} sondage(s)...")
+        deleted = 0
+        last_report = asyncio.get_running_loop().time()
+
+        async def report():
+            nonlocal last_report
+            now = asyncio.get_running_loop().time()
+            if now - last_report >= 2:
+                last_report = now
+                await progress_message.edit(content=f"Suppression des sondages : {deleted}/{len(poll_ids)}")
+
+        bulk_limit = datetime.now(tz=TZ) - timedelta(days=14) + timedelta(minutes=5)
+        recent_ids, old_ids = [], []
+        for poll_id in poll_ids:
+            (recent_ids if discord.utils.snowflake_time(poll_id) > bulk_limit else old_ids).append(poll_id)
+        for start in range(0, len(recent_ids), 100):
+            chunk = recent_ids[start : start + 100]
+            if len(chunk) < 2:
+                old_ids += chunk
+                continue
+            try:
+                await channel.delete_messages([channel.get_partial_message(poll_id) for poll_id in chunk])
+            except discord.Forbidden:
+                old_ids += chunk
+                continue
+            deleted += len(chunk)
+            await report()
+
+        slots = asyncio.Semaphore(concurrency)
+
+        async def delete_one(poll_id: int):
+            nonlocal deleted
+            async with slots:
+                try:
+                    await channel.get_partial_message(poll_id).delete()
+                except discord.NotFound:
+                    pass
+                deleted += 1
+                await report()
+
+        await asyncio.gather(*(delete_one(poll_id) for poll_id in old_ids))
+        await progress_message.edit(content=f"J'ai supprimé {deleted} sondage(s) !")
+        return deleted
+
+    @timed("on_raw_reaction_add")
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         """Checks every event of reaction add to see if it corresponds to a vote and acts in consequence
         """
-        if payload.member.bot:
+        emoji_map = self.emoji_maps.get(payload.message_id)
+        if emoji_map is None or payload.member is None or payload.member.bot:
             return
-        doc = self.active_poll_collection.find_one({"_id": payload.message_id})
-        if not doc:
-            return
-        channel = self.get_channel(payload.channel_id)
-        poll_msg = channel.get_partial_message(payload.message_id)
-        await poll_msg.remove_reaction(payload.emoji, payload.member)
-        
         # checking emojis to see if it corresponds to a the one of a vote, returning if not
-        answer = None
-        for key, emoji in doc["emojis"].items():
-            if discord.partial_emoji.PartialEmoji(name=emoji) == payload.emoji:
-                answer = key
-        if not answer:
+        answer = emoji_map.get(emoji_key(payload.emoji))
+        if answer is None:
             return
-        # constructing the variable to get the new embed of the result, then edit the message with the new embed
-        thread = poll_msg.thread
-        result_msg = thread.get_partial_message(doc["results_id"])
-        names = self.get_name_map(channel)
-        doc["results"][str(payload.user_id)] = answer
-        votes = {str(key): [] for key in doc["answers"].keys()}
-        for votant, vote in doc["results"].items():
-            votes[str(vote)].append(names[int(votant)])
-        await result_msg.edit(embed=self._get_results_embed(doc["answers"].values(), votes.values()))
-        self.active_poll_collection.find_one_and_update({"_id": payload.message_id}, {"$set": {"results":  doc["results"]}})
-        return
+        # votes are anonymous, the reaction is removed in the background
+        poll_msg = self.get_partial_messageable(payload.channel_id).get_partial_message(payload.message_id)
+        self.reaction_removals.enqueue(poll_msg, payload.emoji, payload.member)
+        self._record_vote(payload.message_id, payload.user_id, answer)
+
+    @timed("on_raw_poll_vote_add")
+    async def on_raw_poll_vote_add(self, payload: discord.RawPollVoteActionEvent):
+        """Counts a vote on a discord poll"""
+        if payload.message_id in self.tallies and self.active_polls[payload.message_id]["native"]:
+            self._record_vote(payload.message_id, payload.user_id, str(payload.answer_id))
+
+    @timed("on_raw_poll_vote_remove")
+    async def on_raw_poll_vote_remove(self, payload: discord.RawPollVoteActionEvent):
+        """Removes a vote from a discord poll"""
+        if payload.message_id in self.tallies and self.active_polls[payload.message_id]["native"]:
+            self._record_vote(payload.message_id, payload.user_id, str(payload.answer_id), removed=True)
+
+    def _record_vote(self, poll_id: int, voter: int, answer: str, journal: bool = True, removed: bool = False) -> bool:
+        """Counts a vote, or its removal: journals it, updates the tally and the results, and schedules the write to
+        the database and, for homemade polls, the render of the results
+
+        Returns:
+            bool: Wether the vote changed the results
+        """
+        tally = self.tallies[poll_id]
+        if not (tally.unvote(voter, answer) if removed else tally.vote(voter, answer)):
+            return False
+        if journal:
+            self.journal.record(poll_id, voter, answer, removed=removed)
+        created_at = self.first_vote_pending.pop(poll_id, None)
+        if created_at is not None and not removed:
+            self.first_vote_latencies.append(asyncio.get_running_loop().time() - created_at)
+        doc = self.active_polls[poll_id]
+        choice = tally.result(voter)
+        if choice is None:
+            doc["results"].pop(str(voter), None)
+        else:
+            doc["results"][str(voter)] = choice
+        self.dirty_polls.add(poll_id)
+        if not doc["native"]:
+            self.render_scheduler.mark_dirty(poll_id, lambda: self._render_results(poll_id))
+        return True
+
+    async def _render_results(self, poll_id: int, wait_ready: bool = True) -> None:
+        """Edits the results message of a homemade poll with its current tally. Channels are only cached once the bot
+        is ready, so renders requested before (by the journal replay or the reconciliation) wait for it. Without
+        wait_ready, voters of a channel not cached yet are mentioned instead of named
+        """
+        if wait_ready and not self.is_ready():
+            await self.wait_until_ready()
+        doc = self.active_polls.get(poll_id)
+        if doc is None or doc["results_id"] is None:
+            return
+        channel = self.get_channel(doc["channel_id"])
+        names = await self.get_name_map(channel) if channel is not None else {}
+        embed = self.result_renderers[poll_id].render(self.tallies[poll_id], names, self.name_cache.version(doc["channel_id"]))
+        # the results thread is created from the poll message, so it shares its id
+        result_msg = self.get_partial_messageable(poll_id).get_partial_message(doc["results_id"])
+        await result_msg.edit(embed=embed)
 
     async def _send_discord_poll(
         self,
@@ -162,6 +628,7 @@ class PollClient(discord.Client):
         duration: timedelta,
         thread_name: str = "",
         multiple: bool = False,
+        extra: dict = None,
     ) -> int:
         """Sends a regular discord poll and updates the database with the poll information (excepts for answers)
 
@@ -173,6 +640,7 @@ class PollClient(discord.Client):
             duration (timedelta): duration of the poll
             thread_name (str, optional): If provided, creates a thread with that name under the poll. Defaults to "".
             multiple (bool, optional): Wether to allow multiple answers . Defaults to False.
+            extra (dict, optional): additional fields of the poll document. Defaults to None.
 
         Returns:
             int: id of the poll message
@@ -181,17 +649,25 @@ class PollClient(discord.Client):
         for _, answer in answers.items():
             poll = poll.add_answer(text=answer)
         poll_message = await channel.send(message, poll=poll)
-        await poll_message.create_thread(name=thread_name)
-        self.active_poll_collection.insert_one(
-            {
-                "_id": poll_message.id,
-                "channel_id": channel.id,
-                "close_time": datetime.now(tz=TZ) + duration,
-                "native": True,
-                "question": question,
-                "answers": {index: {"answer": question, "emoji": None} for index, question in answers.items()},
-            }
-        )
+        self.first_vote_pending[poll_message.id] = asyncio.get_running_loop().time()
+        # the poll is registered before its thread is created so that no early vote is dropped. Discord numbers the
+        # answers from 1 in the order they were added, votes are keyed by that number
+        doc = {
+            "_id": poll_message.id,
+            "channel_id": channel.id,
+            "guild_id": channel.guild.id,
+            "close_time": datetime.now(tz=TZ) + duration,
+            "native": True,
+            "multiple": multiple,
+            "question": question,
+            "answers": {str(answer_id): answer for answer_id, answer in enumerate(answers.values(), start=1)},
+            "results": {},
+            **(extra or {}),
+        }
+        self._remember_poll(doc)
+        await self.active_poll_collection.insert_one({**doc, "results": dict(doc["results"])})
+        if thread_name:
+            await poll_message.create_thread(name=thread_name)
         print(f"Successfuly sent poll in {channel.name}!")
         return poll_message.id
 
@@ -204,6 +680,7 @@ class PollClient(discord.Client):
         duration: timedelta,
         thread_name: str = "",
         emojis: Dict[int, str] = None,
+        extra: dict = None,
     ) -> int:
         """Creates and send an homemade version of discord polls, usefull when there is more than 10 answers. If more than 26 answers are provided, emojis is needed
 
@@ -215,6 +692,7 @@ class PollClient(discord.Client):
             duration (timedelta): duration of the poll
             thread_name (str, optional): name of the thread on which results are published. Defaults to "Résultats".
             emojis (Dict[int, str], optional): maping of keys (same as answers) to emojis to use for reactions, needed if more than 26 answers, defaults to A to Z. Defaults to None.
+            extra (dict, optional): additional fields of the poll document. Defaults to None.
 
         Returns:
             int: message id of the poll
@@ -227,31 +705,52 @@ class PollClient(discord.Client):
             emojis = {key: emoji  for key, emoji in zip(answers.keys(),self.get_emoji_AtoZ(len(answers)))}
         poll_embed = self._get_poll_embed(question, answers.values(), emojis.values())
         poll_message = await channel.send(message, embed=poll_embed)
-        for _, emoji in emojis.items():
-            await poll_message.add_reaction(emoji)
-
-        thread = await poll_message.create_thread(name=thread_name if thread_name else "Résultat")
-
-        result_embed = self._get_results_embed(answers.values(), [[] for _ in answers])
-        result_message = await thread.send("Résultats: ", embed=result_embed)
-        
-
-        self.active_poll_collection.insert_one(
-            {
-                "_id": poll_message.id,
-                "results_id": result_message.id,
-                "channel_id": channel.id,
-                "close_time": datetime.now(tz=TZ) + duration,
-                "native": False,
-                "question": question,
-                "answers": convert_dictkeys_str(answers),
-                "emojis": convert_dictkeys_str(emojis),
-                "results": {},
-            }
-        )
+        self.first_vote_pending[poll_message.id] = asyncio.get_running_loop().time()
+
+        # the poll is registered before its reactions exist so that no early vote is dropped
+        doc = {
+            "_id": poll_message.id,
+            "results_id": None,
+            "channel_id": channel.id,
+            "guild_id": channel.guild.id,
+            "close_time": datetime.now(tz=TZ) + duration,
+            "native": False,
+            "question": question,
+            "answers": convert_dictkeys_str(answers),
+            "emojis": convert_dictkeys_str(emojis),
+            "results": {},
+            **(extra or {}),
+        }
+        self._remember_poll(doc)
+        await self.active_poll_collection.insert_one({**doc, "results": dict(doc["results"])})
+
+        async def send_results():
+            thread = await poll_message.create_thread(name=thread_name if thread_name else "Résultat")
+            result_message = await thread.send("Résultats: ", embed=discord.Embed(description=HEADER))
+            doc["results_id"] = result_message.id
+            await self.active_poll_collection.update_one({"_id": doc["_id"]}, {"$set": {"results_id": result_message.id}})
+            if doc["_id"] in self.tallies and len(self.tallies[doc["_id"]]):
+                self.render_scheduler.mark_dirty(doc["_id"], lambda: self._render_results(doc["_id"]))
+
+        await asyncio.gather(send_results(), self._seed_reactions(poll_message, emojis.values()))
         print(f"Successfuly sent poll in {channel.name} !")
         return poll_message.id
 
+    async def _seed_reactions(self, poll_message: discord.Message, emojis: List[str]) -> None:
+        """Adds the answer reactions to a poll in order, paced by the reaction rate limit of the channel"""
+        for emoji in emojis:
+            for attempt in range(3):
+                await self.reaction_limiter.acquire(poll_message.channel.id)
+                await self.rest_limiter.acquire()
+                try:
+                    await poll_message.add_reaction(emoji)
+                    break
+                except discord.HTTPException as e:
+                    if e.status != 429 or attempt == 2:
+                        raise
+                    self.reaction_limiter.bucket(poll_message.channel.id).penalize(1.0 + attempt)
+
+    @timed("send_poll")
     async def send_poll(
         self,
         channel: discord.abc.GuildChannel,
@@ -263,6 +762,7 @@ class PollClient(discord.Client):
         duration: timedelta = timedelta(seconds=30),
         emojis: Dict[int, str] = None,
         multiple: bool = False,
+        extra: dict = None,
     ) -> int:
         """Sends a poll (discord or custom) on a channel
 
@@ -275,6 +775,7 @@ class PollClient(discord.Client):
             thread_name (str, optional): thread name, if poll is discord and set to "", will not create thread. Defaults to "".
             duration (timedelta, optional): duration of the poll. Defaults to timedelta(days=1).
             emojis (Dict[int, str], optional): maping of keys (same as answers) to emojis to use for reactions, needed if more than 26 answers, defaults to A to Z. Only for AUTO or CUSTOM polls.Defaults to None.
+            extra (dict, optional): additional fields stored in the poll document, kept in the archive. Defaults to None.
 
         Raises:
             Exception: When giving more than 26 possible answers without specifying emojis or when giving more than 10 answers in DISCORD mode
@@ -295,37 +796,181 @@ class PollClient(discord.Client):
 
         if mode == self.DISCORD:
             return await self._send_discord_poll(
-                channel, question, answers, message, duration, thread_name=thread_name, multiple=multiple
+                channel, question, answers, message, duration, thread_name=thread_name, multiple=multiple, extra=extra
             )
         else:
             return await self._send_homemade_poll(
-                channel, question, answers, message, duration, thread_name=thread_name, emojis=emojis
+                channel, question, answers, message, duration, thread_name=thread_name, emojis=emojis, extra=extra
             )
 
-    async def close_polls(self):
-        """Removes closed custom polls from database and mark them as such in discord"""
-        docs = self.active_poll_collection.find({"close_time": {"$lt": datetime.now(tz=TZ)}})
-        for doc in docs:
-            if not doc["native"]:
-                channel = self.get_channel(doc["channel_id"])
-                poll_msg = channel.get_partial_message(doc["_id"])
-                poll_embed = self._get_poll_embed(
-                    doc["question"] + "⚠️ SONDAGE CLOS ⚠️", doc["answers"].values(), doc["emojis"].values()
-                )
-                await poll_msg.edit(embed=poll_embed)
-            self.active_poll_collection.find_one_and_delete({"_id": doc["_id"]})
+    @timed("close_polls")
+    async def close_polls(self, concurrency: int = 8) -> int:
+        """Closes every poll whose closing time is passed, concurrently, and waits for them. Polls are normally closed
+        on time by close_scheduler, including the ones that expired while the bot was offline
+
+        Returns:
+            int: number of polls closed
+        """
+        now = datetime.now(tz=TZ)
+        poll_ids = [
+            poll_id for poll_id, doc in self.active_polls.items() if doc["close_time"] < now and poll_id not in self.unresolved_polls
+        ]
+        slots = asyncio.Semaphore(concurrency)
+
+        async def close(poll_id: int):
+            async with slots:
+                try:
+                    await self.close_poll(poll_id)
+                except discord.HTTPException as e:
+                    print(f"Failed to close poll {poll_id} : {e}")
+
+        await asyncio.gather(*(close(poll_id) for poll_id in poll_ids))
+        return len(poll_ids)
+
+    @timed("close_poll")
+    async def close_poll(self, poll_id: int):
+        """Removes a poll from database, archives it and mark it as closed in discord if it is a custom one. The
+        database delete comes first, so a poll already closed (by another worker or before a restart) is never closed
+        twice
+        """
+        if self.is_ready():
+            await self.render_scheduler.flush(poll_id)
+        elif self.render_scheduler.cancel(poll_id):
+            # overdue polls are closed as soon as close_scheduler starts, the wait for the bot to be ready would block
+            await self._render_results(poll_id, wait_ready=False)
+        tally = self.tallies.get(poll_id)
+        self._forget_poll(poll_id)
+        doc = await self.active_poll_collection.find_one_and_delete({"_id": poll_id})
+        if doc is None:
+            return
+        if tally is None:
+            # closed by a worker that did not load the poll, the stored results are the latest ones
+            tally = PollTally.from_results(doc["answers"].keys(), doc.get("results", {}), multiple=doc.get("multiple", False))
+        await self.archive_poll(doc, tally)
+        if doc["native"]:
+            return
+        poll_msg = self.get_partial_messageable(doc["channel_id"]).get_partial_message(doc["_id"])
+        poll_embed = self._get_poll_embed(
+            doc["question"] + "⚠️ SONDAGE CLOS ⚠️", doc["answers"].values(), doc["emojis"].values()
+        )
+        await poll_msg.edit(embed=poll_embed)
     
-    def get_name_map(self, channel: discord.TextChannel) -> Dict[int, str]:
-        """Fill nickname maps of any missing member by their discord nickname
+    async def archive_poll(self, doc: dict, tally: PollTally) -> bool:
+        """Stores a closed poll in closed_poll_collection. Answers are kept as lists, and each voter's choices as
+        indexes in those lists, which is much smaller than the results of the active poll
+
+        Returns:
+            bool: Wether the poll was archived, False if it already was
         """
-        nickname_page = self.nickname_collection.find_one({"_id": channel.id})
-        nickname_map = nickname_page["nicknames"] if nickname_page else {}
-        filtered_members = [member for member in channel.members if not member.bot]
-        nicknames = {
-            member.id: nickname_map[str(member.id)] if str(member.id) in nickname_map.keys() else member.nick
-            for member in filtered_members
+        keys = list(doc["answers"])
+        index = {key: position for position, key in enumerate(keys)}
+        archive = {
+            "_id": doc["_id"],
+            "channel_id": doc["channel_id"],
+            "guild_id": doc.get("guild_id"),
+            "closed_at": datetime.now(tz=TZ),
+            "native": doc["native"],
+            "question": doc["question"],
+            "answer_keys": keys,
+            "answers": list(doc["answers"].values()),
+            "counts": [len(tally.voters[key]) for key in keys],
+            "votes": {str(voter): sorted(index[key] for key in choices) for voter, choices in tally.choices.items()},
         }
-        return nicknames
+        archive.update({key: value for key, value in doc.items() if key not in archive and key not in ARCHIVE_DROPPED})
+        try:
+            await self.closed_poll_collection.insert_one(archive)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def get_poll_results(self, poll_id: int) -> Optional[Dict[str, int]]:
+        """Vote counts by answer key of an active or closed poll, from memory or from a single database query
+
+        Returns:
+            Optional[Dict[str, int]]: the counts, None if the poll is unknown
+        """
+        tally = self.tallies.get(poll_id)
+        if tally is not None:
+            return tally.counts()
+        doc = await self.closed_poll_collection.find_one({"_id": poll_id}, projection={"answer_keys": 1, "counts": 1})
+        return dict(zip(doc["answer_keys"], doc["counts"])) if doc else None
+
+    @timed("get_name_map")
+    async def get_name_map(self, channel: discord.TextChannel) -> Dict[int, str]:
+        """Fill nickname maps of any missing member by their discord nickname. The map is cached and kept up to date
+        from member events, it must not be modified
+        """
+        self.guilds_used[channel.guild.id] = asyncio.get_running_loop().time()
+        names = self.name_cache.get(channel.id)
+        if names is not None:
+            return names
+        if not channel.guild.chunked:
+            await self.request_members(channel.guild)
+        nickname_page = await self.nickname_collection.find_one({"_id": channel.id})
+        nickname_map = nickname_page["nicknames"] if nickname_page else {}
+        discord_names = {member.id: member.display_name for member in channel.members if not member.bot}
+        return self.name_cache.put(channel.id, channel.guild.id, nickname_map, discord_names)
+
+    async def request_members(self, guild: discord.Guild) -> None:
+        """Downloads the members of a guild, once when several channels of the guild need them at the same time"""
+        task = self.member_requests.get(guild.id)
+        if task is None:
+            task = self.member_requests[guild.id] = asyncio.create_task(guild.chunk())
+            task.add_done_callback(lambda _: self.member_requests.pop(guild.id, None))
+        await asyncio.shield(task)
+
+    def active_guild_ids(self) -> Set[int]:
+        """Guilds whose members are needed soon, the ones of the channels returned by warm_channel_ids"""
+        channels = (self.get_channel(channel_id) for channel_id in self.warm_channel_ids())
+        return {channel.guild.id for channel in channels if channel is not None and channel.guild is not None}
+
+    @tasks.loop(minutes=10)
+    async def evict_members_task(self):
+        self.evict_idle_members()
+
+    def evict_idle_members(self) -> int:
+        """Drops the members and name maps of the guilds without active polls or sessions whose members were not
+        needed for member_idle_time seconds
+
+        Returns:
+            int: number of guilds evicted
+        """
+        now = asyncio.get_running_loop().time()
+        active = self.active_guild_ids()
+        idle = [
+            guild_id for guild_id, used in self.guilds_used.items()
+            if now - used > self.member_idle_time and guild_id not in active and guild_id not in self.member_requests
+        ]
+        for guild_id in idle:
+            del self.guilds_used[guild_id]
+            self.name_cache.evict_guild(guild_id)
+            guild = self.get_guild(guild_id)
+            if guild is not None:
+                # discord.py has no public way to empty the member cache of a guild
+                for member in list(guild.members):
+                    if member.id != self.user.id:
+                        guild._remove_member(member)
+        return len(idle)
+
+    def _update_cached_member(self, member: discord.Member) -> None:
+        """Adds, renames or removes member in the cached name maps of its guild"""
+        if member.bot:
+            return
+        for channel_id in self.name_cache.channels_of(member.guild.id):
+            channel = self.get_channel(channel_id)
+            if channel is not None and channel.permissions_for(member).read_messages:
+                self.name_cache.set_member(channel_id, member.id, member.display_name)
+            else:
+                self.name_cache.remove_member([channel_id], member.id)
+
+    async def on_member_join(self, member: discord.Member):
+        self._update_cached_member(member)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        self._update_cached_member(after)
+
+    async def on_member_remove(self, member: discord.Member):
+        self.name_cache.remove_member(self.name_cache.channels_of(member.guild.id), member.id)
 
     @staticmethod
     def get_emoji_AtoZ(length: int) -> List[str]:
@@ -352,41 +997,22 @@ class PollClient(discord.Client):
         embed = discord.Embed(description=description)
         return embed
 
-    @staticmethod
-    def _get_results_embed(answers: List[str], votes: List[List[str]]) -> discord.Embed:
-        """Gets the embed of the result of the poll
-
-        Args:
-            answers (List[str]): List of the possible answers
-            votes (List[List[str]]): List, each item representing the list name of the votants of the answer of the same index
-
-        Returns:
-            discord.Embed: _description_
+    async def add_nickname(self, channel_id: int, member_id: str, nickname: str):
+        """Adds a nickname to the nickname config for the channel
         """
-        filtered_results = [pair for pair in zip(answers, votes) if len(pair[1]) >= 0]# removing answers with zero votes
-        sorting_key = lambda item: len(item[1])
-        sorted_results = sorted(filtered_results, key=sorting_key, reverse=True)
-        description = "-----------\n" + "\n".join(
-            f"{answer:11} : {len(votants):2} |  " + ", ".join(votant for votant in votants) for answer, votants 
-                                                                                            in sorted_results
-                                                                                            if len(votants) > 0
+        await self.nickname_collection.update_one(
+            {"_id": channel_id}, {"$set": {f"nicknames.{member_id}": nickname}}, upsert=True
         )
-        embed = discord.Embed(description=description)
-        return embed
+        self.name_cache.set_nickname(channel_id, int(member_id), nickname)
 
-    def add_nickname(self, channel_id: int, member_id: str, nickname: str):
-        """Adds a nickname to the nickname config for the channel
-        """
-        nicknames = self.nickname_collection.find_one({"_id": channel_id})
-        if not nicknames:
-            nicknames = {"_id": channel_id, "nicknames": {member_id: nickname}}
-            self.nickname_collection.insert_one(nicknames)
-        else:
-            nicknames["nicknames"][member_id] = nickname
-            self.nickname_collection.replace_one({"_id": channel_id}, nicknames)
+    def get_help(self) -> str:
+        return command_help(self.tree)
 
-    def get_help(self):
-        return "Not implemented yet"
+
+def emoji_key(emoji: discord.PartialEmoji) -> str:
+    """Hashable key of an emoji, the id of custom emojis and the characters of unicode ones
+    """
+    return str(emoji.id) if emoji.id is not None else emoji.name
 
 
 def convert_dictkeys_str(dictionnary: dict) -> dict:
@@ -396,11 +1022,54 @@ def convert_dictkeys_str(dictionnary: dict) -> dict:
         return {}
     return {str(key): nick for key, nick in dictionnary.items()}
 
+class ShardedPollClient(PollClient, discord.AutoShardedClient):
+    """PollClient running several shards in one process. Each worker process owns a range of shards (shard_ids),
+    background work shared between workers is coordinated through database leases
+    """
+
+
+def parse_shard_ids(shard_ids: Optional[str]) -> Optional[List[int]]:
+    """Parses a shard range like "0-3,8" into a list of shard ids, None when not set
+    """
+    if not shard_ids:
+        return None
+    ids = []
+    for part in shard_ids.split(","):
+        first, _, last = part.strip().partition("-")
+        ids += range(int(first), int(last or first) + 1)
+    return ids
+
+
+def sharding_kwargs() -> dict:
+    """Reads the shard configuration of the worker from the SHARD_COUNT and SHARD_IDS environment variables
+    """
+    shard_count = os.getenv("SHARD_COUNT")
+    if not shard_count:
+        return {}
+    return {"shard_count": int(shard_count), "shard_ids": parse_shard_ids(os.getenv("SHARD_IDS"))}
+
+
+def metrics_kwargs() -> dict:
+    """Reads the port of the metrics endpoint from the METRICS_PORT environment variable
+    """
+    port = os.getenv("METRICS_PORT")
+    return {"metrics_port": int(port)} if port else {}
+
+
+def cache_kwargs() -> dict:
+    """Reads the member cache policy from the MEMBER_CACHE environment variable, "lazy" (default) to fetch members
+    on demand or "full" to download every member at startup
+    """
+    return {"lazy_members": os.getenv("MEMBER_CACHE", "lazy") != "full"}
+
+
 def main():
     intents = discord.Intents.default()
     intents.members = True
-    intents.message_content = True
-    client = PollClient(intents=intents)
+    kwargs = sharding_kwargs()
+    kwargs.update(metrics_kwargs())
+    kwargs.update(cache_kwargs())
+    client = ShardedPollClient(intents=intents, **kwargs) if "shard_count" in kwargs else PollClient(intents=intents, **kwargs)
     client.run(TOKEN)
 
 
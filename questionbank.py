@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import re
+import sys
+import time
+import unicodedata
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from schema import ensure_schema
+from storage import Collection, DuplicateKeyError, open_database
+
+ANSWER_SEPARATOR = "|"  # between the answers of the answers column of a csv
+
+
+def normalize_question(question: str) -> str:
+    """Text of a question as compared for duplicates: case, accents, spacing and final punctuation are ignored"""
+    text = unicodedata.normalize("NFKD", question.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", text).strip(" ?!.")
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha1(normalize_question(question).encode()).hexdigest()
+
+
+def question_doc(question: str, answers: List[str], ordinal: int) -> dict:
+    return {"question": question, "answers": answers, "ordinal": ordinal, "text_hash": question_hash(question)}
+
+
+async def next_ordinal(collection: Collection) -> int:
+    """Ordinal of the next question added to the bank, questions are numbered from 0 in the order they are added"""
+    last = await collection.find_one({"ordinal": {"$exists": True}}, {"ordinal": 1}, sort=[("ordinal", -1)])
+    return last["ordinal"] + 1 if last else 0
+
+
+def shuffled_index(key: str, index: int, size: int) -> int:
+    """Element index of a pseudo random permutation of range(size) picked by key, so an order can be walked without
+    being stored. A small Feistel network permutes the smallest power of 4 above size, and is applied again to the
+    values falling outside of range(size)
+    """
+    half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+    mask = (1 << half_bits) - 1
+    value = index
+    while True:
+        left, right = value >> half_bits, value & mask
+        for round in range(4):
+            digest = hashlib.blake2b(f"{key}:{round}:{right}".encode(), digest_size=8).digest()
+            left, right = right, left ^ (int.from_bytes(digest, "big") & mask)
+        value = (left << half_bits) | right
+        if value < size:
+            return value
+
+
+def format_of(filename: str) -> str:
+    """Format of a question file from its extension, jsonl by default"""
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+
+async def iterate(lines: Iterable[str]) -> AsyncIterator[str]:
+    """Lines of a local file as an async iterator, like the lines of a download"""
+    for line in lines:
+        yield line
+
+
+async def parse_questions(lines: AsyncIterator, format: str = "jsonl") -> AsyncIterator[Optional[dict]]:
+    """Parses questions line by line, as {"question": str, "answers": List[str]}. jsonl lines are objects with those
+    keys, csv files have a header with a question and an optional answers column. Invalid entries give None
+
+    Args:
+        lines (AsyncIterator): lines of the file, str or utf-8 bytes
+        format (str, optional): "jsonl" or "csv". Defaults to "jsonl".
+    """
+    header = None
+    pending = ""
+    async for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8-sig")
+        if format == "jsonl":
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                yield _question_entry(entry.get("question"), entry.get("answers") or [])
+            except (ValueError, AttributeError):
+                yield None
+            continue
+        # a quoted csv field can hold line breaks, a record ends on a line leaving every quote closed
+        pending += line
+        if pending.count('"') % 2:
+            continue
+        record, pending = pending, ""
+        row = next(csv.reader(io.StringIO(record)), None)
+        if not row:
+            continue
+        if header is None:
+            header = [column.strip().lower() for column in row]
+            continue
+        entry = dict(zip(header, row))
+        answers = [answer.strip() for answer in (entry.get("answers") or "").split(ANSWER_SEPARATOR)]
+        yield _question_entry(entry.get("question"), [answer for answer in answers if answer])
+
+
+def _question_entry(question, answers) -> Optional[dict]:
+    if not isinstance(question, str) or not question.strip() or not isinstance(answers, list):
+        return None
+    return {"question": question.strip(), "answers": [str(answer) for answer in answers]}
+
+
+async def import_questions(
+    collection: Collection,
+    questions: AsyncIterator[Optional[dict]],
+    batch_size: int = 1000,
+    progress: Callable[[Dict[str, int]], None] = None,
+    attempts: int = 5,
+) -> Dict[str, int]:
+    """Inserts a stream of questions by batches of batch_size, skipping the ones already in the bank. Imported
+    questions are numbered after the existing ones, so running sessions ask them in their next pass
+
+    Args:
+        collection (Collection): question collection, with its unique text_hash index
+        questions (AsyncIterator[Optional[dict]]): questions as given by parse_questions
+        batch_size (int, optional): questions per insert. Defaults to 1000.
+        progress (Callable[[Dict[str, int]], None], optional): called with the counts after each batch. Defaults to None.
+        attempts (int, optional): inserts of a batch whose ordinals are taken by questions added at the same time.
+            Defaults to 5.
+
+    Returns:
+        Dict[str, int]: questions read, inserted, skipped as duplicates and invalid
+
+    Raises:
+        DuplicateKeyError: when the ordinals of a batch are still taken after attempts inserts
+    """
+    stats = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+    batch: List[dict] = []
+
+    async def insert():
+        # duplicates are dropped before numbering, they would leave holes in the ordinals
+        hashes = [doc["text_hash"] for doc in batch]
+        existing = {doc["text_hash"] for doc in await collection.find({"text_hash": {"$in": hashes}}, {"text_hash": 1})}
+        docs = []
+        for doc in batch:
+            if doc["text_hash"] not in existing:
+                existing.add(doc["text_hash"])
+                docs.append(doc)
+        inserted = 0
+        for attempt in range(attempts):
+            first = await next_ordinal(collection)
+            for offset, doc in enumerate(docs):
+                doc["ordinal"] = first + offset
+            try:
+                inserted += await collection.insert_many(docs, ordered=False, skip=["text_hash"])
+                break
+            except DuplicateKeyError as e:
+                # questions added at the same time took some of the ordinals, the others are numbered again
+                inserted += e.inserted
+                docs = e.documents
+                if attempt == attempts - 1:
+                    raise
+        stats["inserted"] += inserted
+        stats["duplicates"] += len(batch) - inserted
+        batch.clear()
+        if progress is not None:
+            progress(dict(stats))
+
+    async for entry in questions:
+        stats["read"] += 1
+        if entry is None:
+            stats["invalid"] += 1
+            continue
+        batch.append(question_doc(entry["question"], entry["answers"], 0))
+        if len(batch) >= batch_size:
+            await insert()
+    if batch:
+        await insert()
+    return stats
+
+
+async def export_questions(collection: Collection, write: Callable[[str], None], format: str = "jsonl", batch_size: int = 1000) -> int:
+    """Writes every question of the bank, reading it batch by batch from a cursor
+
+    Args:
+        collection (Collection): question collection
+        write (Callable[[str], None]): called with each chunk of text, like the write method of a file
+        format (str, optional): "jsonl" or "csv", as read back by parse_questions. Defaults to "jsonl".
+        batch_size (int, optional): questions read at once. Defaults to 1000.
+
+    Returns:
+        int: number of questions exported
+    """
+    exported = 0
+    if format == "csv":
+        write("question,answers\r\n")
+    async for docs in collection.find_batches({}, {"question": 1, "answers": 1}, batch_size=batch_size):
+        chunk = io.StringIO()
+        writer = csv.writer(chunk)
+        for doc in docs:
+            answers = doc.get("answers") or []
+            if format == "csv":
+                writer.writerow([doc["question"], ANSWER_SEPARATOR.join(answers)])
+            else:
+                chunk.write(json.dumps({"question": doc["question"], "answers": answers}, ensure_ascii=False) + "\n")
+        write(chunk.getvalue())
+        exported += len(docs)
+    return exported
+
+
+async def main(args: argparse.Namespace) -> None:
+    database = open_database(args.db_url, args.db_name)
+    await ensure_schema(database, ["questions"])
+    collection = database.get_collection("questions")
+    start = time.perf_counter()
+    try:
+        if args.command == "import":
+            with open(args.file, encoding="utf-8-sig", newline="") as file:
+                stats = await import_questions(
+                    collection,
+                    parse_questions(iterate(file), format_of(args.file)),
+                    batch_size=args.batch_size,
+                    progress=lambda stats: print(f"{time.perf_counter() - start:7.1f}s {stats}", file=sys.stderr),
+                )
+            print(stats)
+        else:
+            with open(args.file, "w", encoding="utf-8", newline="") as file:
+                exported = await export_questions(collection, file.write, format_of(args.file), batch_size=args.batch_size)
+            print(f"{exported} questions exported to {args.file}")
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import and export of the askus question bank, as jsonl or csv")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file", help="question file, csv when its extension is .csv, jsonl otherwise")
+    parser.add_argument("--db-url", default="mongodb://localhost:27017/")
+    parser.add_argument("--db-name", default="poll_db")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,84 @@
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+
+class TokenBucket:
+    """Token bucket pacing the REST calls of a discord rate limit bucket. Waiters are served in order, and a bucket
+    can be blocked for a while when discord answers with a 429
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Args:
+            rate (float): tokens refilled per second
+            burst (int): maximum number of tokens available at once
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = None
+        self.blocked_until = 0.0
+        self.lock: Optional[asyncio.Lock] = None  # created in the running loop
+        self.waited = 0.0  # total seconds spent waiting for tokens
+
+    def _refill(self, now: float) -> None:
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """Waits until a token is available and takes it"""
+        loop = asyncio.get_running_loop()
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = loop.time()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+    def penalize(self, retry_after: float) -> None:
+        """Blocks the bucket for retry_after seconds, called when discord rate limited us anyway"""
+        self.blocked_until = max(self.blocked_until, asyncio.get_running_loop().time() + retry_after)
+        self.tokens = 0.0
+
+    @property
+    def busy(self) -> bool:
+        return self.lock is not None and self.lock.locked()
+
+
+class BucketLimiter:
+    """Token buckets by key (a channel, a message...), the least recently used buckets are dropped past max_buckets"""
+
+    def __init__(self, rate: float, burst: int, max_buckets: int = 1024):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self.buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            while len(self.buckets) > self.max_buckets:
+                oldest = next(iter(self.buckets))
+                if self.buckets[oldest].busy:
+                    break
+                del self.buckets[oldest]
+        self.buckets.move_to_end(key)
+        return bucket
+
+    async def acquire(self, key: Hashable) -> None:
+        await self.bucket(key).acquire()
+
+    def stats(self) -> Dict[str, float]:
+        return {"buckets": len(self.buckets), "waited": sum(bucket.waited for bucket in self.buckets.values())}
@@ -0,0 +1,100 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Optional, Tuple
+
+import discord
+
+from ratelimit import BucketLimiter, TokenBucket
+
+
+class ReactionRemovalQueue:
+    """Removes voters' reactions in the background so recording a vote never waits on discord. Each message has
+    its own queue and worker, a reaction queued twice is removed once, and failed removals are retried with backoff
+    """
+
+    def __init__(self, channel_limiter: BucketLimiter, rest_limiter: TokenBucket, max_attempts: int = 5):
+        """
+        Args:
+            channel_limiter (BucketLimiter): reaction rate limit buckets, by channel id
+            rest_limiter (TokenBucket): global REST rate limit bucket
+            max_attempts (int, optional): attempts per reaction before giving up. Defaults to 5.
+        """
+        self.channel_limiter = channel_limiter
+        self.rest_limiter = rest_limiter
+        self.max_attempts = max_attempts
+        self.queues: Dict[int, "OrderedDict[Tuple[Hashable, int], tuple]"] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.removed = 0
+        self.failed = 0
+        self.lags: Deque[float] = deque(maxlen=100)  # seconds between queuing and removal
+
+    def enqueue(self, message: discord.PartialMessage, emoji: discord.PartialEmoji, member: discord.Member) -> None:
+        """Queues the removal of the reaction emoji of member on message"""
+        queue = self.queues.setdefault(message.id, OrderedDict())
+        key = (emoji.id or emoji.name, member.id)
+        if key not in queue:
+            queue[key] = (message, emoji, member, asyncio.get_running_loop().time())
+        if message.id not in self.workers:
+            self.workers[message.id] = asyncio.create_task(self._work(message.id))
+
+    async def _work(self, message_id: int) -> None:
+        queue = self.queues[message_id]
+        try:
+            while queue:
+                _, (message, emoji, member, queued_at) = queue.popitem(last=False)
+                await self._remove(message, emoji, member)
+                self.lags.append(asyncio.get_running_loop().time() - queued_at)
+        finally:
+            del self.queues[message_id]
+            del self.workers[message_id]
+
+    async def _remove(self, message: discord.PartialMessage, emoji: discord.PartialEmoji, member: discord.Member):
+        bucket = self.channel_limiter.bucket(message.channel.id)
+        for attempt in range(self.max_attempts):
+            await bucket.acquire()
+            await self.rest_limiter.acquire()
+            try:
+                await message.remove_reaction(emoji, member)
+                self.removed += 1
+                return
+            except discord.NotFound:
+                return
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    bucket.penalize(2**attempt)
+                elif e.status < 500:
+                    break
+                else:
+                    await asyncio.sleep(2**attempt)
+        self.failed += 1
+        print(f"Failed to remove a reaction on {message.id}")
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the queued removals to be done, including the ones queued meanwhile
+
+        Args:
+            timeout (float, optional): seconds after which to stop waiting. Defaults to None.
+
+        Returns:
+            bool: Wether every queue is empty, False if timeout expired first
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.workers:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            await asyncio.wait(list(self.workers.values()), timeout=remaining)
+        return True
+
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "depth": self.depth(),
+            "messages": len(self.queues),
+            "removed": self.removed,
+            "failed": self.failed,
+            "lag": max(self.lags, default=0.0),
+        }
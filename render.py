@@ -0,0 +1,78 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class RenderScheduler:
+    """Coalesces the edits of a message: every render requested within window seconds of the first one is merged
+    into a single edit, and there is never more than one edit in flight for the same message.
+    """
+
+    def __init__(self, window: float = 1.0):
+        """
+        Args:
+            window (float, optional): seconds during which renders of the same message are merged. Defaults to 1.0.
+        """
+        self.window = window
+        self.pending: Dict[Hashable, Callable[[], Awaitable]] = {}
+        self.tasks: Dict[Hashable, asyncio.Task] = {}
+        self.renders_requested = 0
+        self.edits_sent = 0
+
+    def mark_dirty(self, key: Hashable, render: Callable[[], Awaitable]) -> None:
+        """Schedules render for the message key, replacing any render of that message not sent yet
+
+        Args:
+            key (Hashable): id of the message to edit
+            render (Callable[[], Awaitable]): coroutine function doing the edit, called with the latest state
+        """
+        self.renders_requested += 1
+        self.pending[key] = render
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.create_task(self._run(key))
+
+    async def flush(self, key: Hashable) -> None:
+        """Sends the pending render of key right away and waits for it"""
+        task = self.tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+        render = self.pending.pop(key, None)
+        if render is not None:
+            await self._render(render)
+
+    def cancel(self, key: Hashable) -> bool:
+        """Drops the pending render of key
+
+        Returns:
+            bool: Wether a render was pending
+        """
+        task = self.tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+        return self.pending.pop(key, None) is not None
+
+    async def _run(self, key: Hashable) -> None:
+        try:
+            while key in self.pending:
+                await asyncio.sleep(self.window)
+                render = self.pending.pop(key, None)
+                if render is not None:
+                    await self._render(render)
+        finally:
+            if self.tasks.get(key) is asyncio.current_task():
+                del self.tasks[key]
+
+    async def _render(self, render: Callable[[], Awaitable]) -> None:
+        self.edits_sent += 1
+        try:
+            await render()
+        except Exception as e:
+            # a failed render must not stop the task rendering the next votes of the message
+            print(f"Failed to render results : {e!r}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "votes_received": self.renders_requested,
+            "edits_sent": self.edits_sent,
+            "edits_saved": self.renders_requested - self.edits_sent,
+            "edits_pending": len(self.pending),
+        }
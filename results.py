@@ -0,0 +1,95 @@
+from typing import Dict, List, Tuple
+
+import discord
+
+from tally import PollTally
+
+# discord embed limits
+MAX_FIELDS = 25
+MAX_FIELD_NAME = 256
+MAX_FIELD_VALUE = 1024
+MAX_DESCRIPTION = 4096
+MAX_EMBED = 6000
+
+HEADER = "-----------"
+
+
+def truncate(text: str, length: int) -> str:
+    return text if len(text) <= length else text[: length - 1] + "…"
+
+
+class ResultsRenderer:
+    """Builds the results embed of a homemade poll. Each answer is an embed field listing its voters, and the
+    formatted list of an answer is kept until its voters or the names of the channel change, so a render after a
+    vote only formats the answer that received it. Polls too large for the names to fit in an embed, or with more
+    voters than max_named_voters, are rendered as counts only
+    """
+
+    def __init__(self, answers: Dict[str, str], max_named_voters: int = 1000):
+        """
+        Args:
+            answers (Dict[str, str]): answers of the poll by key
+            max_named_voters (int, optional): number of voters above which only the counts are shown. Defaults to 1000.
+        """
+        self.answers = answers
+        self.max_named_voters = max_named_voters
+        self.fragments: Dict[str, Tuple[Tuple[int, int], str]] = {}  # answer key to ((tally version, names version), voters)
+        self.fragments_built = 0
+
+    def render(self, tally: PollTally, names: Dict[int, str], names_version: int = 0) -> discord.Embed:
+        """Results embed of the tally
+
+        Args:
+            tally (PollTally): votes of the poll
+            names (Dict[int, str]): names of the members by id, members without a name are mentioned
+            names_version (int, optional): version of names, formatted voters are kept while it does not change. Defaults to 0.
+        """
+        counts = [(key, len(voters)) for key, voters in tally.voters.items() if voters]
+        counts.sort(key=lambda item: item[1], reverse=True)
+        if len(tally) > self.max_named_voters or len(counts) > MAX_FIELDS:
+            return self.render_counts(counts)
+        embed = discord.Embed(description=HEADER)
+        size = len(HEADER)
+        for key, count in counts:
+            name = truncate(f"{self.answers[key]} : {count}", MAX_FIELD_NAME)
+            value = self._fragment(key, tally, names, names_version)
+            size += len(name) + len(value)
+            if size > MAX_EMBED:
+                return self.render_counts(counts)
+            embed.add_field(name=name, value=value, inline=False)
+        return embed
+
+    def render_counts(self, counts: List[Tuple[str, int]]) -> discord.Embed:
+        """Compact results embed, the number of votes of each answer without the voters"""
+        lines = [HEADER]
+        size = len(HEADER)
+        for index, (key, count) in enumerate(counts):
+            line = truncate(f"{count:>4} | {self.answers[key]}", 200)
+            if size + len(line) + 1 > MAX_DESCRIPTION - 20:
+                lines.append(f"… +{len(counts) - index}")
+                break
+            lines.append(line)
+            size += len(line) + 1
+        return discord.Embed(description="\n".join(lines))
+
+    def _fragment(self, key: str, tally: PollTally, names: Dict[int, str], names_version: int) -> str:
+        version = (tally.versions[key], names_version)
+        cached = self.fragments.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        self.fragments_built += 1
+        voters = tally.voters[key]
+        shown: List[str] = []
+        size = 0
+        # only the names that fit are formatted, the others are counted
+        for voter in voters:
+            name = names.get(voter, f"<@{voter}>")
+            if size + len(name) + 2 > MAX_FIELD_VALUE - 12:
+                break
+            shown.append(name)
+            size += len(name) + 2
+        fragment = ", ".join(shown)
+        if len(shown) < len(voters):
+            fragment += f" … +{len(voters) - len(shown)}"
+        self.fragments[key] = (version, fragment)
+        return fragment
@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+import itertools
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+TZ = timezone.utc
+
+
+class DeadlineScheduler:
+    """Calls callback with the key of every deadline as soon as it is due, sleeping until the next deadline
+    instead of polling. Deadlines are kept in a heap, cancelled or rescheduled entries are dropped lazily. Due keys
+    are handled concurrently, so deadlines falling at the same time do not wait for each other.
+    """
+
+    def __init__(self, callback: Callable[[Hashable], Awaitable], max_sleep: float = 300, concurrency: int = 32):
+        """
+        Args:
+            callback (Callable[[Hashable], Awaitable]): coroutine function called with the key of each due deadline
+            max_sleep (float, optional): maximum seconds slept at once, protects against clock jumps. Defaults to 300.
+            concurrency (int, optional): maximum number of callbacks running at the same time. Defaults to 32.
+        """
+        self.callback = callback
+        self.max_sleep = max_sleep
+        self.concurrency = concurrency
+        self.heap: List[Tuple[datetime, int, Hashable]] = []
+        self.deadlines: Dict[Hashable, datetime] = {}
+        self.counter = itertools.count()
+        self.wakeup: Optional[asyncio.Event] = None  # created in the running loop
+        self.task: Optional[asyncio.Task] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.running: Set[asyncio.Task] = set()  # callbacks in progress
+
+    def schedule(self, key: Hashable, deadline: datetime) -> None:
+        """Schedules key at deadline, replacing its previous deadline if any"""
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, next(self.counter), key))
+        if self.heap[0][2] == key and self.wakeup is not None:
+            self.wakeup.set()
+
+    def cancel(self, key: Hashable) -> None:
+        self.deadlines.pop(key, None)
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.slots = asyncio.Semaphore(self.concurrency)
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for task in self.running:
+            task.cancel()
+
+    def _next(self) -> Optional[Tuple[datetime, Hashable]]:
+        while self.heap:
+            deadline, _, key = self.heap[0]
+            if self.deadlines.get(key) == deadline:
+                return deadline, key
+            heapq.heappop(self.heap)
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            self.wakeup.clear()
+            upcoming = self._next()
+            delay = self.max_sleep
+            if upcoming is not None:
+                delay = min(delay, (upcoming[0] - datetime.now(tz=TZ)).total_seconds())
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay if upcoming is not None else None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.heap)
+            del self.deadlines[upcoming[1]]
+            task = asyncio.create_task(self._dispatch(upcoming[1]))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _dispatch(self, key: Hashable) -> None:
+        async with self.slots:
+            try:
+                await self.callback(key)
+            except Exception as e:
+                print(f"Failed to handle deadline of {key} : {e}")
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
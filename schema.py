@@ -0,0 +1,97 @@
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Tuple
+
+TZ = timezone.utc
+
+# polls are normally closed on time, the TTL only removes the ones left behind (a week past their closing time)
+STALE_POLL_SECONDS = 7 * 24 * 3600
+
+INDEXES: Dict[str, List[Tuple[List[Tuple[str, int]], dict]]] = {
+    "active_polls": [
+        ([("close_time", 1)], {"name": "close_time_ttl", "expireAfterSeconds": STALE_POLL_SECONDS}),
+        ([("channel_id", 1)], {"name": "channel_id"}),
+    ],
+    "nicknames": [],  # only queried by _id
+    "closed_polls": [],  # only queried by _id
+    "leases": [
+        ([("expires", 1)], {"name": "expires_ttl", "expireAfterSeconds": 0}),
+    ],
+    "session_stats": [],  # only queried by _id, the session id
+    "member_stats": [
+        ([("session_id", 1), ("votes_received", -1)], {"name": "session_votes_received"}),
+        ([("session_id", 1), ("polls_voted", -1)], {"name": "session_polls_voted"}),
+    ],
+    "askus": [
+        ([("next_poll_time", 1)], {"name": "due_sessions", "partialFilterExpression": {"paused": False}}),
+    ],
+    "questions": [
+        # questions created before ordinals and hashes existed have none until ensure_indexes fills them in
+        (
+            [("ordinal", 1)],
+            {"name": "ordinal", "unique": True, "partialFilterExpression": {"ordinal": {"$exists": True}}},
+        ),
+        (
+            [("text_hash", 1)],
+            {"name": "text_hash", "unique": True, "partialFilterExpression": {"text_hash": {"$exists": True}}},
+        ),
+    ],
+}
+
+# hot queries and the index they must use, as (collection, filter, sort, index name)
+QUERIES: List[Tuple[str, dict, list, str]] = [
+    ("active_polls", {"close_time": {"$lt": datetime.now(tz=TZ)}}, None, "close_time_ttl"),
+    ("active_polls", {"channel_id": 0}, None, "channel_id"),
+    ("askus", {"paused": False, "next_poll_time": {"$lt": datetime.now(tz=TZ)}}, None, "due_sessions"),
+    ("member_stats", {"session_id": 0}, [("votes_received", -1)], "session_votes_received"),
+    ("questions", {"ordinal": 0}, None, "ordinal"),
+    ("questions", {"ordinal": {"$exists": True}}, [("ordinal", -1)], "ordinal"),
+    ("questions", {"text_hash": {"$in": ["0"]}}, None, "text_hash"),
+]
+
+
+async def ensure_schema(database, collections: Iterable[str]) -> None:
+    """Creates the indexes of collections, creating an existing index is a no-op"""
+    for name in collections:
+        collection = database.get_collection(name)
+        for keys, options in INDEXES[name]:
+            await collection.create_index(keys, **options)
+
+
+def _used_indexes(plan: dict) -> List[str]:
+    names = [plan["indexName"]] if "indexName" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            names += _used_indexes(plan[key])
+    for stage in plan.get("inputStages", []):
+        names += _used_indexes(stage)
+    return names
+
+
+def check_query_plans(db_url: str = "mongodb://localhost:27017/", db_name: str = "poll_db") -> Dict[str, bool]:
+    """Explains every query of QUERIES on a mongo database and tells wether it uses its index. Also runs from the
+    command line : python schema.py [db_url] [db_name]
+
+    Returns:
+        Dict[str, bool]: for each query, wether its winning plan uses the expected index
+    """
+    from pymongo import MongoClient
+
+    client = MongoClient(db_url)
+    database = client.get_database(db_name)
+    results = {}
+    try:
+        for collection, filter, sort, index in QUERIES:
+            cursor = database.get_collection(collection).find(filter)
+            if sort:
+                cursor = cursor.sort(sort)
+            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+            results[f"{collection} {filter}"] = index in _used_indexes(plan)
+    finally:
+        client.close()
+    return results
+
+
+if __name__ == "__main__":
+    for query, uses_index in check_query_plans(*sys.argv[1:]).items():
+        print(f"{'OK     ' if uses_index else 'NO INDEX'} {query}")
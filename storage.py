@@ -0,0 +1,461 @@
+import asyncio
+import copy
+import functools
+import itertools
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+MEMORY_URL = "memory://"
+
+
+class DuplicateKeyError(Exception):
+    """Raised when a write would duplicate a unique key, whatever the backend"""
+
+    def __init__(self, message: str = "", key: Optional[str] = None, documents: List[dict] = (), inserted: int = 0):
+        """
+        Args:
+            key (str, optional): field of the unique index, when known. Defaults to None.
+            documents (List[dict], optional): documents not inserted by an unordered insert_many. Defaults to ().
+            inserted (int, optional): documents inserted by an unordered insert_many. Defaults to 0.
+        """
+        super().__init__(message)
+        self.key = key
+        self.documents = list(documents)
+        self.inserted = inserted
+
+
+class Collection:
+    """Async interface of a document collection, a small subset of the pymongo collection api.
+    Every method is a coroutine so handlers never block the event loop on a database round-trip.
+    """
+
+    async def find_one(self, filter: dict, projection: dict = None, sort: List[Tuple[str, int]] = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def find(
+        self, filter: dict = None, projection: dict = None, sort: List[Tuple[str, int]] = None, limit: int = 0
+    ) -> List[dict]:
+        raise NotImplementedError
+
+    def find_batches(self, filter: dict = None, projection: dict = None, batch_size: int = 1000) -> AsyncIterator[List[dict]]:
+        """Streams the documents matching filter by batches of batch_size, without loading them all at once"""
+        raise NotImplementedError
+
+    async def insert_one(self, document: dict) -> Any:
+        raise NotImplementedError
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True, skip: Optional[List[str]] = None) -> int:
+        """Inserts a batch of documents in a single round-trip. When not ordered, documents duplicating a unique key
+        are skipped instead of stopping the batch
+
+        Args:
+            skip (List[str], optional): when not ordered, fields whose duplicates are skipped, the documents duplicating
+                another unique field are reported in a DuplicateKeyError once the others are inserted. Defaults to
+                None, skipping the duplicates of every unique field.
+
+        Returns:
+            int: number of documents inserted
+        """
+        raise NotImplementedError
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False) -> int:
+        """Returns:
+            int: number of documents modified, 0 when the update changed nothing or inserted the document
+        """
+        raise NotImplementedError
+
+    async def find_one_and_update(self, filter: dict, update: dict, upsert: bool = False) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def find_one_and_delete(self, filter: dict) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def replace_one(self, filter: dict, document: dict, upsert: bool = False) -> int:
+        raise NotImplementedError
+
+    async def delete_many(self, filter: dict) -> int:
+        raise NotImplementedError
+
+    async def bulk_update(self, updates: List[Tuple[dict, dict]], upsert: bool = False) -> int:
+        """Applies a batch of (filter, update) pairs in a single round-trip"""
+        raise NotImplementedError
+
+    async def count_documents(self, filter: dict) -> int:
+        raise NotImplementedError
+
+    async def create_index(self, keys: List[Tuple[str, int]], **kwargs) -> str:
+        raise NotImplementedError
+
+
+class MongoCollection(Collection):
+    """Runs a pymongo collection on a bounded thread pool"""
+
+    def __init__(self, collection, executor: ThreadPoolExecutor):
+        from pymongo.errors import DuplicateKeyError as MongoDuplicateKeyError
+
+        self.collection = collection
+        self.executor = executor
+        self.duplicate_key_error = MongoDuplicateKeyError
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        except self.duplicate_key_error as e:
+            raise DuplicateKeyError(str(e), key=next(iter((e.details or {}).get("keyPattern", {})), None)) from e
+
+    async def find_one(self, filter, projection=None, sort=None):
+        return await self._run(self.collection.find_one, filter, projection, sort=sort)
+
+    async def find(self, filter=None, projection=None, sort=None, limit=0):
+        return await self._run(lambda: list(self.collection.find(filter or {}, projection, sort=sort, limit=limit)))
+
+    async def find_batches(self, filter=None, projection=None, batch_size=1000):
+        cursor = self.collection.find(filter or {}, projection, batch_size=batch_size)
+        try:
+            while True:
+                batch = await self._run(lambda: list(itertools.islice(cursor, batch_size)))
+                if not batch:
+                    return
+                yield batch
+        finally:
+            cursor.close()
+
+    async def insert_one(self, document):
+        result = await self._run(self.collection.insert_one, document)
+        return result.inserted_id
+
+    async def insert_many(self, documents, ordered=True, skip=None):
+        from pymongo.errors import BulkWriteError
+
+        if not documents:
+            return 0
+        try:
+            result = await self._run(self.collection.insert_many, documents, ordered=ordered)
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if ordered or any(error["code"] != 11000 for error in errors):
+                raise
+            failed = [
+                documents[error["index"]]
+                for error in errors
+                if skip is not None and not set(error.get("keyPattern", {})) <= set(skip)
+            ]
+            if failed:
+                raise DuplicateKeyError(f"{len(failed)} duplicate key(s)", documents=failed, inserted=e.details["nInserted"]) from e
+            return e.details["nInserted"]
+        return len(result.inserted_ids)
+
+    async def update_one(self, filter, update, upsert=False):
+        result = await self._run(self.collection.update_one, filter, update, upsert=upsert)
+        return result.modified_count
+
+    async def find_one_and_update(self, filter, update, upsert=False):
+        return await self._run(self.collection.find_one_and_update, filter, update, upsert=upsert)
+
+    async def find_one_and_delete(self, filter):
+        return await self._run(self.collection.find_one_and_delete, filter)
+
+    async def replace_one(self, filter, document, upsert=False):
+        result = await self._run(self.collection.replace_one, filter, document, upsert=upsert)
+        return result.modified_count
+
+    async def delete_many(self, filter):
+        result = await self._run(self.collection.delete_many, filter)
+        return result.deleted_count
+
+    async def bulk_update(self, updates, upsert=False):
+        from pymongo import UpdateOne
+
+        if not updates:
+            return 0
+        result = await self._run(
+            self.collection.bulk_write, [UpdateOne(filter, update, upsert=upsert) for filter, update in updates], ordered=False
+        )
+        return result.modified_count
+
+    async def count_documents(self, filter):
+        return await self._run(self.collection.count_documents, filter)
+
+    async def create_index(self, keys, **kwargs):
+        return await self._run(self.collection.create_index, keys, **kwargs)
+
+
+class MongoDatabase:
+    """Mongo database whose collections run on a thread pool of max_workers threads"""
+
+    def __init__(self, db_url: str, db_name: str, max_workers: int = 8):
+        from pymongo import MongoClient
+
+        self.client = MongoClient(db_url, tz_aware=True)
+        self.database = self.client.get_database(db_name)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mongo")
+
+    def get_collection(self, name: str) -> MongoCollection:
+        return MongoCollection(self.database.get_collection(name), self.executor)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
+
+class MemoryCollection(Collection):
+    """In memory collection, understands the operators used by the clients. Meant for tests and local runs"""
+
+    def __init__(self):
+        self.documents: Dict[Any, dict] = {}
+        # _id of the documents by value of the fields with a unique index, only enforced on inserts
+        self.unique_values: Dict[str, Dict[Any, Any]] = {}
+
+    def _candidates(self, filter: dict):
+        """Documents that may match filter, a lookup instead of a scan when filtering on values of _id or of a
+        unique field"""
+        for key in itertools.chain(["_id"], self.unique_values):
+            condition = filter.get(key, _MISSING)
+            if condition is _MISSING:
+                continue
+            if not isinstance(condition, dict):
+                values = [condition]
+            elif list(condition) == ["$in"]:
+                values = condition["$in"]
+            else:
+                continue
+            ids = values if key == "_id" else [self.unique_values[key].get(value, _MISSING) for value in values]
+            return [self.documents[_id] for _id in dict.fromkeys(ids) if _id in self.documents]
+        return self.documents.values()
+
+    async def find_one(self, filter, projection=None, sort=None):
+        docs = await self.find(filter, projection, sort=sort, limit=1)
+        return docs[0] if docs else None
+
+    async def find(self, filter=None, projection=None, sort=None, limit=0):
+        docs = [doc for doc in self._candidates(filter or {}) if _match(doc, filter or {})]
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda doc: _get(doc, key), reverse=direction < 0)
+        if limit:
+            docs = docs[:limit]
+        return [_project(doc, projection) for doc in docs]
+
+    async def find_batches(self, filter=None, projection=None, batch_size=1000):
+        docs = await self.find(filter, projection)
+        for start in range(0, len(docs), batch_size):
+            yield docs[start : start + batch_size]
+
+    async def insert_one(self, document):
+        document.setdefault("_id", uuid.uuid4().hex)
+        if document["_id"] in self.documents:
+            raise DuplicateKeyError(f"Duplicate key {document['_id']}", key="_id")
+        for key, values in self.unique_values.items():
+            if _get(document, key, _MISSING) in values:
+                raise DuplicateKeyError(f"Duplicate {key} {_get(document, key)}", key=key)
+        self._remember_unique(document)
+        self.documents[document["_id"]] = copy.deepcopy(document)
+        return document["_id"]
+
+    async def insert_many(self, documents, ordered=True, skip=None):
+        inserted = 0
+        failed = []
+        for document in documents:
+            try:
+                await self.insert_one(document)
+                inserted += 1
+            except DuplicateKeyError as e:
+                if ordered:
+                    raise
+                if skip is not None and e.key not in skip:
+                    failed.append(document)
+        if failed:
+            raise DuplicateKeyError(f"{len(failed)} duplicate key(s)", documents=failed, inserted=inserted)
+        return inserted
+
+    def _remember_unique(self, doc: dict) -> None:
+        for key, values in self.unique_values.items():
+            value = _get(doc, key, _MISSING)
+            if value is not _MISSING:
+                values[value] = doc["_id"]
+
+    def _forget_unique(self, doc: dict) -> None:
+        for key, values in self.unique_values.items():
+            value = _get(doc, key, _MISSING)
+            if value is not _MISSING and values.get(value) == doc["_id"]:
+                del values[value]
+
+    async def update_one(self, filter, update, upsert=False):
+        previous = await self.find_one_and_update(filter, update, upsert=upsert)
+        # counted like mongo's modified_count, a document left unchanged is not modified
+        return int(previous is not None and previous != self.documents[previous["_id"]])
+
+    async def find_one_and_update(self, filter, update, upsert=False):
+        doc = next((doc for doc in self._candidates(filter) if _match(doc, filter)), None)
+        if doc is None:
+            if upsert:
+                new_doc = {key: value for key, value in filter.items() if not key.startswith("$")}
+                _apply_update(new_doc, update)
+                await self.insert_one(new_doc)
+            return None
+        previous = copy.deepcopy(doc)
+        _apply_update(doc, update)
+        self._forget_unique(previous)
+        self._remember_unique(doc)
+        return previous
+
+    async def find_one_and_delete(self, filter):
+        doc = next((doc for doc in self._candidates(filter) if _match(doc, filter)), None)
+        if doc is None:
+            return None
+        self._forget_unique(doc)
+        return self.documents.pop(doc["_id"])
+
+    async def replace_one(self, filter, document, upsert=False):
+        doc = next((doc for doc in self._candidates(filter) if _match(doc, filter)), None)
+        if doc is None:
+            if upsert:
+                await self.insert_one(document)
+            return 0
+        document = copy.deepcopy(document)
+        document["_id"] = doc["_id"]
+        self._forget_unique(doc)
+        self._remember_unique(document)
+        self.documents[doc["_id"]] = document
+        return int(document != doc)
+
+    async def delete_many(self, filter):
+        ids = [doc["_id"] for doc in self._candidates(filter) if _match(doc, filter)]
+        for _id in ids:
+            self._forget_unique(self.documents.pop(_id))
+        return len(ids)
+
+    async def bulk_update(self, updates, upsert=False):
+        modified = 0
+        for filter, update in updates:
+            modified += await self.update_one(filter, update, upsert=upsert)
+        return modified
+
+    async def count_documents(self, filter):
+        return sum(1 for doc in self._candidates(filter) if _match(doc, filter))
+
+    async def create_index(self, keys, **kwargs):
+        if kwargs.get("unique") and len(keys) == 1 and keys[0][0] not in self.unique_values:
+            key = keys[0][0]
+            self.unique_values[key] = {}
+            for doc in self.documents.values():
+                self._remember_unique(doc)
+        return kwargs.get("name", "_".join(f"{key}_{direction}" for key, direction in keys))
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self.collections: Dict[str, MemoryCollection] = {}
+
+    def get_collection(self, name: str) -> MemoryCollection:
+        return self.collections.setdefault(name, MemoryCollection())
+
+    def close(self):
+        pass
+
+
+def open_database(db_url: str, db_name: str, max_workers: int = 8):
+    """Opens the database behind db_url, "memory://" gives an in memory database
+
+    Args:
+        db_url (str): url of the mongo database, or "memory://"
+        db_name (str): name of the database
+        max_workers (int, optional): maximum number of concurrent mongo calls. Defaults to 8.
+    """
+    if db_url.startswith(MEMORY_URL):
+        return MemoryDatabase()
+    return MongoDatabase(db_url, db_name, max_workers=max_workers)
+
+
+_MISSING = object()
+
+
+def _get(doc: dict, key: str, default=None):
+    """Gets the value of a dotted key in a document"""
+    for part in key.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return default
+        doc = doc[part]
+    return doc
+
+
+def _match(doc: dict, filter: dict) -> bool:
+    for key, condition in filter.items():
+        if key == "$or":
+            if not any(_match(doc, sub_filter) for sub_filter in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(_match(doc, sub_filter) for sub_filter in condition):
+                return False
+            continue
+        value = _get(doc, key, _MISSING)
+        if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+            if not all(_match_operator(value, op, operand) for op, operand in condition.items()):
+                return False
+        elif value is _MISSING or value != condition:
+            return False
+    return True
+
+
+def _match_operator(value, op: str, operand) -> bool:
+    if op == "$exists":
+        return (value is not _MISSING) == bool(operand)
+    if op == "$ne":
+        return value is _MISSING or value != operand
+    if op == "$nin":
+        return value is _MISSING or value not in operand
+    if value is _MISSING:
+        return False
+    if op == "$in":
+        return value in operand
+    if op == "$lt":
+        return value < operand
+    if op == "$lte":
+        return value <= operand
+    if op == "$gt":
+        return value > operand
+    if op == "$gte":
+        return value >= operand
+    raise ValueError(f"Unsupported operator {op}")
+
+
+def _project(doc: dict, projection: dict) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    included = [key for key, value in projection.items() if value]
+    if included:
+        result = {key: copy.deepcopy(doc[key]) for key in included if key in doc}
+        if projection.get("_id", 1):
+            result["_id"] = doc["_id"]
+        return result
+    return {key: copy.deepcopy(value) for key, value in doc.items() if key not in projection}
+
+
+def _parent(doc: dict, key: str) -> Tuple[dict, str]:
+    parts = key.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    return doc, parts[-1]
+
+
+def _apply_update(doc: dict, update: dict):
+    for op, fields in update.items():
+        for key, value in fields.items():
+            parent, last = _parent(doc, key)
+            if op == "$set":
+                parent[last] = copy.deepcopy(value)
+            elif op == "$unset":
+                parent.pop(last, None)
+            elif op == "$inc":
+                parent[last] = parent.get(last, 0) + value
+            elif op == "$push":
+                parent.setdefault(last, []).append(copy.deepcopy(value))
+            elif op == "$addToSet":
+                if value not in parent.setdefault(last, []):
+                    parent[last].append(copy.deepcopy(value))
+            elif op == "$pull":
+                parent[last] = [item for item in parent.get(last, []) if item != value]
+            else:
+                raise ValueError(f"Unsupported update operator {op}")
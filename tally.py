@@ -0,0 +1,83 @@
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+
+class PollTally:
+    """Vote counts of a poll, kept up to date vote by vote so recording a vote does not depend on the number of voters"""
+
+    def __init__(self, keys: Iterable[str], multiple: bool = False):
+        """
+        Args:
+            keys (Iterable[str]): keys of the answers, in display order
+            multiple (bool, optional): Wether a voter can choose several answers. Defaults to False.
+        """
+        self.multiple = multiple
+        self.voters: Dict[str, Set[int]] = {str(key): set() for key in keys}
+        self.choices: Dict[int, Set[str]] = {}
+        self.versions: Dict[str, int] = dict.fromkeys(self.voters, 0)  # changes of the voters of each answer
+
+    @classmethod
+    def from_results(cls, keys: Iterable[str], results: Dict[str, Union[str, List[str]]], multiple: bool = False) -> "PollTally":
+        """Builds the tally of the results stored in the database ({voter id: answer key, or list of answer keys when
+        multiple answers are allowed})"""
+        tally = cls(keys, multiple=multiple)
+        for voter, answers in results.items():
+            for answer in [answers] if isinstance(answers, str) else answers:
+                tally.vote(int(voter), answer)
+        return tally
+
+    def vote(self, voter: int, key: str) -> bool:
+        """Records the vote of voter for key, moving its previous vote if multiple answers are not allowed
+
+        Returns:
+            bool: Wether the tally changed
+        """
+        key = str(key)
+        if key not in self.voters:
+            return False
+        choices = self.choices.setdefault(voter, set())
+        if key in choices:
+            return False
+        if not self.multiple:
+            for previous in choices:
+                self.voters[previous].discard(voter)
+                self.versions[previous] += 1
+            choices.clear()
+        choices.add(key)
+        self.voters[key].add(voter)
+        self.versions[key] += 1
+        return True
+
+    def unvote(self, voter: int, key: str) -> bool:
+        """Removes the vote of voter for key
+
+        Returns:
+            bool: Wether the tally changed
+        """
+        key = str(key)
+        choices = self.choices.get(voter)
+        if not choices or key not in choices:
+            return False
+        choices.discard(key)
+        self.voters[key].discard(voter)
+        self.versions[key] += 1
+        if not choices:
+            del self.choices[voter]
+        return True
+
+    def counts(self) -> Dict[str, int]:
+        return {key: len(voters) for key, voters in self.voters.items()}
+
+    def result(self, voter: int) -> Optional[Union[str, List[str]]]:
+        """Choice of voter in the database format, None if it did not vote"""
+        choices = self.choices.get(voter)
+        if not choices:
+            return None
+        return sorted(choices) if self.multiple else next(iter(choices))
+
+    def results(self) -> Dict[str, Union[str, List[str]]]:
+        """Results in their database format, {voter id: answer key, or list of answer keys when multiple answers are
+        allowed}"""
+        return {str(voter): self.result(voter) for voter in self.choices}
+
+    def __len__(self) -> int:
+        return len(self.choices)
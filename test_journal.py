@@ -0,0 +1,46 @@
+import sqlite3
+
+from journal import VoteJournal
+
+
+def test_replay_in_order_with_removals(tmp_path):
+    journal = VoteJournal(str(tmp_path / "votes.journal"))
+    journal.record(1, 10, "0")
+    journal.record(1, 10, "0", removed=True)
+    journal.record(2, 11, "1")
+    assert list(journal.replay()) == [(1, 10, "0", False), (1, 10, "0", True), (2, 11, "1", False)]
+    journal.close()
+
+
+def test_compact_drops_the_votes_written(tmp_path):
+    journal = VoteJournal(str(tmp_path / "votes.journal"))
+    journal.record(1, 10, "0")
+    seq = journal.record(1, 11, "1")
+    journal.record(1, 12, "2")
+    journal.compact(seq)
+    assert list(journal.replay()) == [(1, 12, "2", False)]
+    assert len(journal) == 1
+    journal.close()
+
+
+def test_votes_survive_a_restart(tmp_path):
+    path = str(tmp_path / "votes.journal")
+    journal = VoteJournal(path)
+    seq = journal.record(1, 10, "0")
+    journal.close()
+    journal = VoteJournal(path)
+    assert journal.last_seq == seq
+    assert list(journal.replay()) == [(1, 10, "0", False)]
+    journal.close()
+
+
+def test_journal_written_before_removals_is_migrated(tmp_path):
+    path = str(tmp_path / "votes.journal")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE votes (seq INTEGER PRIMARY KEY AUTOINCREMENT, poll_id INTEGER, voter INTEGER, answer TEXT)")
+    connection.execute("INSERT INTO votes (poll_id, voter, answer) VALUES (1, 10, '0')")
+    connection.commit()
+    connection.close()
+    journal = VoteJournal(path)
+    assert list(journal.replay()) == [(1, 10, "0", False)]
+    journal.close()
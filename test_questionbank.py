@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from questionbank import import_questions, iterate, normalize_question, parse_questions, question_hash, shuffled_index
+from schema import ensure_schema
+from storage import open_database
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 10, 64, 1000, 1023])
+def test_shuffled_index_is_a_permutation(size):
+    assert sorted(shuffled_index("seed", index, size) for index in range(size)) == list(range(size))
+
+
+def test_shuffled_index_depends_on_the_key():
+    orders = {tuple(shuffled_index(key, index, 100) for index in range(100)) for key in ("a", "b", "c")}
+    assert len(orders) == 3
+    assert [shuffled_index("a", index, 100) for index in range(100)] != list(range(100))
+
+
+def test_duplicates_ignore_case_accents_and_punctuation():
+    assert normalize_question("  Qui est  le PLUS drôle ?") == "qui est le plus drole"
+    assert question_hash("Qui est le plus drôle ?") == question_hash("qui est le plus drole")
+
+
+def parse(lines, format):
+    async def collect():
+        return [entry async for entry in parse_questions(iterate(lines), format)]
+
+    return asyncio.run(collect())
+
+
+def test_parse_jsonl():
+    lines = ['{"question": "q1", "answers": ["a", "b"]}\n', "\n", "not json\n", '{"answers": []}\n']
+    assert parse(lines, "jsonl") == [{"question": "q1", "answers": ["a", "b"]}, None, None]
+
+
+def test_parse_csv_with_multiline_fields():
+    lines = ["question,answers\r\n", '"first line\n', 'second line",a|b\r\n', "q2,\r\n"]
+    assert parse(lines, "csv") == [
+        {"question": "first line\nsecond line", "answers": ["a", "b"]},
+        {"question": "q2", "answers": []},
+    ]
+
+
+def test_import_skips_duplicates_and_numbers_questions():
+    async def main():
+        database = open_database("memory://", "test")
+        await ensure_schema(database, ["questions"])
+        collection = database.get_collection("questions")
+        lines = [f'{{"question": "question {index % 5}"}}\n' for index in range(8)]
+        stats = await import_questions(collection, parse_questions(iterate(lines)), batch_size=3)
+        return stats, sorted(doc["ordinal"] for doc in await collection.find({}))
+
+    stats, ordinals = asyncio.run(main())
+    assert stats == {"read": 8, "inserted": 5, "duplicates": 3, "invalid": 0}
+    assert ordinals == list(range(5))
+
+
+class InterleavedCollection:
+    """Collection whose calls let the other tasks run first, as database round-trips do"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, attribute):
+        method = getattr(self.collection, attribute)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            return await method(*args, **kwargs)
+
+        return call
+
+
+def test_concurrent_imports_number_every_question_once():
+    async def main():
+        database = open_database("memory://", "test")
+        await ensure_schema(database, ["questions"])
+        collection = InterleavedCollection(database.get_collection("questions"))
+        imports = [[f'{{"question": "{name} {index}"}}\n' for index in range(50)] for name in ("first", "second")]
+        stats = await asyncio.gather(*(import_questions(collection, parse_questions(iterate(lines)), batch_size=10) for lines in imports))
+        return stats, sorted(doc["ordinal"] for doc in await collection.find({}))
+
+    stats, ordinals = asyncio.run(main())
+    assert [(entry["inserted"], entry["duplicates"]) for entry in stats] == [(50, 0), (50, 0)]
+    assert ordinals == list(range(100))
@@ -0,0 +1,56 @@
+from results import MAX_EMBED, MAX_FIELD_VALUE, MAX_FIELDS, ResultsRenderer
+from tally import PollTally
+
+
+def tally_of(answers: int, voters: int) -> PollTally:
+    tally = PollTally([str(key) for key in range(answers)])
+    for voter in range(voters):
+        tally.vote(voter, str(voter % answers))
+    return tally
+
+
+def test_answers_are_sorted_by_votes_with_their_voters():
+    tally = PollTally(["0", "1"])
+    tally.vote(1, "1")
+    tally.vote(2, "1")
+    tally.vote(3, "0")
+    embed = ResultsRenderer({"0": "non", "1": "oui"}).render(tally, {1: "Alice", 3: "Carol"})
+    assert [(field.name, field.value) for field in embed.fields] == [("oui : 2", "Alice, <@2>"), ("non : 1", "Carol")]
+
+
+def test_embed_limits():
+    tally = tally_of(20, 900)
+    names = {voter: f"a rather long member name {voter}" for voter in range(900)}
+    embed = ResultsRenderer({str(key): f"answer {key}" for key in range(20)}).render(tally, names)
+    assert len(embed) <= MAX_EMBED
+    assert len(embed.fields) <= MAX_FIELDS
+    assert all(len(field.value) <= MAX_FIELD_VALUE for field in embed.fields)
+
+
+def test_long_voter_lists_are_truncated_with_a_count():
+    tally = tally_of(1, 500)
+    names = {voter: f"member {voter}" for voter in range(500)}
+    value = ResultsRenderer({"0": "a"}).render(tally, names).fields[0].value
+    assert len(value) <= MAX_FIELD_VALUE
+    assert value.endswith(f"+{500 - value.count(',') - 1}")
+
+
+def test_counts_only_above_max_named_voters_or_max_fields():
+    renderer = ResultsRenderer({"0": "a", "1": "b"}, max_named_voters=10)
+    embed = renderer.render(tally_of(2, 11), {})
+    assert not embed.fields and "   6 | a" in embed.description
+    answers = {str(key): f"answer {key}" for key in range(MAX_FIELDS + 1)}
+    embed = ResultsRenderer(answers).render(tally_of(MAX_FIELDS + 1, MAX_FIELDS + 1), {})
+    assert not embed.fields
+
+
+def test_only_the_answer_voted_is_formatted_again():
+    tally = tally_of(3, 30)
+    renderer = ResultsRenderer({"0": "a", "1": "b", "2": "c"})
+    renderer.render(tally, {})
+    built = renderer.fragments_built
+    tally.vote(100, "1")
+    renderer.render(tally, {})
+    assert renderer.fragments_built == built + 1
+    renderer.render(tally, {}, names_version=1)
+    assert renderer.fragments_built == built + 4
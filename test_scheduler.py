@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from scheduler import DeadlineScheduler
+
+TZ = timezone.utc
+
+
+def soon(seconds: float) -> datetime:
+    return datetime.now(tz=TZ) + timedelta(seconds=seconds)
+
+
+def run_scheduler(schedule, seconds: float, callback=None, **kwargs) -> list:
+    """Keys handled by a scheduler running for seconds, in the order they were handled"""
+    handled = []
+
+    async def record(key):
+        handled.append(key)
+
+    async def main():
+        scheduler = DeadlineScheduler(callback or record, **kwargs)
+        scheduler.start()
+        schedule(scheduler)
+        await asyncio.sleep(seconds)
+        scheduler.stop()
+
+    asyncio.run(main())
+    return handled
+
+
+def test_deadlines_fire_in_order():
+    def schedule(scheduler):
+        scheduler.schedule("late", soon(0.15))
+        scheduler.schedule("early", soon(0.05))
+        scheduler.schedule("past", soon(-10))
+
+    assert run_scheduler(schedule, 0.3) == ["past", "early", "late"]
+
+
+def test_cancel_and_reschedule():
+    def schedule(scheduler):
+        scheduler.schedule("cancelled", soon(0.05))
+        scheduler.cancel("cancelled")
+        scheduler.schedule("moved", soon(0.05))
+        scheduler.schedule("moved", soon(0.1))
+        assert len(scheduler) == 1
+
+    assert run_scheduler(schedule, 0.3) == ["moved"]
+
+
+def test_simultaneous_deadlines_run_concurrently():
+    starts = []
+
+    async def slow(key):
+        starts.append(asyncio.get_running_loop().time())
+        await asyncio.sleep(0.1)
+
+    def schedule(scheduler):
+        deadline = soon(0.05)
+        for key in range(20):
+            scheduler.schedule(key, deadline)
+
+    run_scheduler(schedule, 0.4, callback=slow, concurrency=10)
+    assert len(starts) == 20
+    # two waves of 10, instead of 20 callbacks one after another
+    assert max(starts) - min(starts) < 0.18
+
+
+def test_a_failing_callback_does_not_stop_the_scheduler():
+    handled = []
+
+    async def callback(key):
+        if key == "broken":
+            raise RuntimeError("broken")
+        handled.append(key)
+
+    def schedule(scheduler):
+        scheduler.schedule("broken", soon(0.02))
+        scheduler.schedule("next", soon(0.05))
+
+    run_scheduler(schedule, 0.2, callback=callback)
+    assert handled == ["next"]
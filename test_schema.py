@@ -0,0 +1,48 @@
+import asyncio
+import os
+
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+
+from schema import INDEXES, check_query_plans, ensure_schema  # noqa: E402
+from storage import open_database  # noqa: E402
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+
+
+@pytest.fixture(scope="module")
+def db_name():
+    """Name of a scratch database on the mongod of MONGO_URL, with the indexes of every collection"""
+    client = pymongo.MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        client.close()
+        pytest.skip(f"no mongod reachable at {MONGO_URL}")
+    name = f"askus_schema_test_{os.getpid()}"
+    database = open_database(MONGO_URL, name)
+    try:
+        asyncio.run(ensure_schema(database, INDEXES))
+    finally:
+        database.close()
+    yield name
+    client.drop_database(name)
+    client.close()
+
+
+def test_hot_queries_use_their_index(db_name):
+    results = check_query_plans(MONGO_URL, db_name)
+    assert results
+    assert [query for query, uses_index in results.items() if not uses_index] == []
+
+
+def test_indexes_are_created(db_name):
+    client = pymongo.MongoClient(MONGO_URL)
+    try:
+        database = client.get_database(db_name)
+        for collection, indexes in INDEXES.items():
+            names = set(database.get_collection(collection).index_information())
+            assert {options["name"] for _, options in indexes} <= names
+    finally:
+        client.close()
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from storage import DuplicateKeyError, open_database
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def collection():
+    collection = open_database("memory://", "test").get_collection("docs")
+    run(collection.insert_many([{"_id": index, "n": index, "tags": ["even" if index % 2 == 0 else "odd"]} for index in range(6)]))
+    return collection
+
+
+def ids(docs):
+    return [doc["_id"] for doc in docs]
+
+
+def test_query_operators(collection):
+    assert ids(run(collection.find({"n": {"$gte": 2, "$lt": 4}}))) == [2, 3]
+    assert ids(run(collection.find({"n": {"$in": [1, 5]}}))) == [1, 5]
+    assert ids(run(collection.find({"_id": {"$nin": [0, 1, 2, 3]}}))) == [4, 5]
+    assert ids(run(collection.find({"$or": [{"n": 0}, {"n": {"$gt": 4}}]}))) == [0, 5]
+    assert ids(run(collection.find({"missing": {"$exists": False}, "n": {"$ne": 0}}))) == [1, 2, 3, 4, 5]
+
+
+def test_sort_limit_and_projection(collection):
+    docs = run(collection.find({}, {"n": 1}, sort=[("n", -1)], limit=2))
+    assert docs == [{"_id": 5, "n": 5}, {"_id": 4, "n": 4}]
+    assert run(collection.find_one({"_id": 3}, {"tags": 0})) == {"_id": 3, "n": 3}
+
+
+def test_update_operators(collection):
+    run(collection.update_one({"_id": 0}, {"$set": {"a.b": 1}, "$inc": {"n": 2}, "$push": {"tags": "x"}}))
+    run(collection.update_one({"_id": 0}, {"$addToSet": {"tags": "x"}, "$pull": {"tags": "even"}, "$unset": {"a": ""}}))
+    assert run(collection.find_one({"_id": 0})) == {"_id": 0, "n": 2, "tags": ["x"]}
+
+
+def test_update_returns_the_modified_count_like_mongo(collection):
+    assert run(collection.update_one({"_id": 1}, {"$set": {"n": 10}})) == 1
+    assert run(collection.update_one({"_id": 1}, {"$set": {"n": 10}})) == 0
+    assert run(collection.update_one({"_id": 99}, {"$set": {"n": 1}}, upsert=True)) == 0
+    assert run(collection.find_one({"_id": 99})) == {"_id": 99, "n": 1}
+    assert run(collection.bulk_update([({"_id": 2}, {"$inc": {"n": 1}}), ({"_id": 3}, {"$set": {"n": 3}})])) == 1
+    assert run(collection.replace_one({"_id": 4}, {"n": 4, "tags": ["even"]})) == 0
+    assert run(collection.replace_one({"_id": 4}, {"n": 40})) == 1
+
+
+def test_unique_index(collection):
+    run(collection.create_index([("n", 1)], unique=True))
+    with pytest.raises(DuplicateKeyError):
+        run(collection.insert_one({"n": 1}))
+    assert run(collection.insert_many([{"n": 1}, {"n": 6}, {"n": 6}], ordered=False)) == 1
+    run(collection.find_one_and_delete({"n": 6}))
+    run(collection.insert_one({"n": 6}))
+    assert ids(run(collection.find({"n": {"$in": [2, 3]}}))) == [2, 3]
+
+
+def test_delete_and_count(collection):
+    assert run(collection.delete_many({"tags": ["odd"]})) == 3
+    assert run(collection.count_documents({})) == 3
+    assert run(collection.find_one_and_delete({"_id": 0}))["_id"] == 0
+    assert run(collection.find_one_and_delete({"_id": 0})) is None
+
+
+def test_find_batches(collection):
+    async def batches():
+        return [ids(batch) async for batch in collection.find_batches({}, batch_size=4)]
+
+    assert run(batches()) == [[0, 1, 2, 3], [4, 5]]
+
+
+def test_unordered_insert_reports_duplicates_of_fields_not_skipped(collection):
+    run(collection.create_index([("n", 1)], unique=True))
+    run(collection.create_index([("name", 1)], unique=True))
+    run(collection.insert_one({"n": 10, "name": "a"}))
+    with pytest.raises(DuplicateKeyError) as error:
+        run(collection.insert_many([{"n": 11, "name": "a"}, {"n": 10, "name": "b"}, {"n": 12, "name": "c"}], ordered=False, skip=["name"]))
+    assert error.value.inserted == 1
+    assert [doc["n"] for doc in error.value.documents] == [10]
@@ -0,0 +1,53 @@
+from tally import PollTally
+
+
+def test_vote_moves_the_previous_vote():
+    tally = PollTally(["0", "1"])
+    assert tally.vote(1, "0")
+    assert tally.vote(1, "1")
+    assert tally.counts() == {"0": 0, "1": 1}
+    assert tally.result(1) == "1"
+    assert len(tally) == 1
+
+
+def test_vote_twice_and_unknown_answer_change_nothing():
+    tally = PollTally(["0", "1"])
+    tally.vote(1, "0")
+    versions = dict(tally.versions)
+    assert not tally.vote(1, "0")
+    assert not tally.vote(1, "7")
+    assert tally.versions == versions
+
+
+def test_multiple_answers():
+    tally = PollTally(["0", "1", "2"], multiple=True)
+    tally.vote(1, "2")
+    tally.vote(1, "0")
+    assert tally.result(1) == ["0", "2"]
+    assert tally.unvote(1, "2")
+    assert tally.result(1) == ["0"]
+    assert tally.counts() == {"0": 1, "1": 0, "2": 0}
+
+
+def test_unvote_forgets_the_voter_without_choices():
+    tally = PollTally(["0"])
+    tally.vote(1, "0")
+    assert tally.unvote(1, "0")
+    assert not tally.unvote(1, "0")
+    assert tally.result(1) is None
+    assert len(tally) == 0
+
+
+def test_versions_change_only_for_the_answers_touched():
+    tally = PollTally(["0", "1", "2"])
+    tally.vote(1, "0")
+    tally.vote(1, "1")
+    assert tally.versions == {"0": 2, "1": 1, "2": 0}
+
+
+def test_results_round_trip():
+    results = {"1": "0", "2": "1", "3": "1"}
+    tally = PollTally.from_results(["0", "1"], results)
+    assert tally.results() == results
+    multiple = {"1": ["0", "1"], "2": ["1"]}
+    assert PollTally.from_results(["0", "1"], multiple, multiple=True).results() == multiple